@@ -12,7 +12,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 load_dotenv()
 
 from database import postgres_engine, Base
-from models import Location, User, Rating, Anime, Genre, Season
+from models import Location, User, Rating, Anime, Genre, Season, PrecomputedRecommendation
 
 config = context.config
 
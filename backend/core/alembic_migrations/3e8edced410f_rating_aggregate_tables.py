@@ -0,0 +1,66 @@
+"""Rating aggregate tables
+
+Revision ID: 3e8edced410f
+Revises: df1c7d9658a9
+Create Date: 2026-10-18 22:05:37.190841
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e8edced410f'
+down_revision: Union[str, None] = 'df1c7d9658a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rating_score_counts',
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.Column('ratingCount', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('score')
+    )
+    op.create_table('anime_rating_stats',
+    sa.Column('animeId', sa.Integer(), nullable=False),
+    sa.Column('ratingCount', sa.Integer(), nullable=False),
+    sa.Column('scoreSum', sa.BigInteger(), nullable=False),
+    sa.Column('positiveCount', sa.Integer(), nullable=False),
+    sa.Column('positivePercentage', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['animeId'], ['anime.animeId'], ),
+    sa.PrimaryKeyConstraint('animeId')
+    )
+    op.create_index(op.f('ix_anime_rating_stats_positivePercentage'), 'anime_rating_stats', ['positivePercentage'], unique=False)
+    op.create_table('user_rating_stats',
+    sa.Column('userId', sa.Integer(), nullable=False),
+    sa.Column('ratingCount', sa.Integer(), nullable=False),
+    sa.Column('scoreSum', sa.BigInteger(), nullable=False),
+    sa.Column('positiveCount', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['userId'], ['users.userId'], ),
+    sa.PrimaryKeyConstraint('userId')
+    )
+
+    # Existing ratings are aggregated once here, rating writes keep the tables up to date from then on
+    op.execute('INSERT INTO rating_score_counts (score, "ratingCount") SELECT score, COUNT(*) FROM ratings GROUP BY score')
+    op.execute(
+        'INSERT INTO anime_rating_stats ("animeId", "ratingCount", "scoreSum", "positiveCount", "positivePercentage") '
+        'SELECT "animeId", COUNT(*), SUM(score), COUNT(*) FILTER (WHERE score > 5), COUNT(*) FILTER (WHERE score > 5) * 100.0 / COUNT(*) '
+        'FROM ratings GROUP BY "animeId"'
+    )
+    op.execute(
+        'INSERT INTO user_rating_stats ("userId", "ratingCount", "scoreSum", "positiveCount") '
+        'SELECT "userId", COUNT(*), SUM(score), COUNT(*) FILTER (WHERE score > 5) '
+        'FROM ratings GROUP BY "userId"'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_rating_stats')
+    op.drop_index(op.f('ix_anime_rating_stats_positivePercentage'), table_name='anime_rating_stats')
+    op.drop_table('anime_rating_stats')
+    op.drop_table('rating_score_counts')
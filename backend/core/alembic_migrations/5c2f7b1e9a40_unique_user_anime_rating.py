@@ -0,0 +1,49 @@
+"""Unique user anime rating
+
+Revision ID: 5c2f7b1e9a40
+Revises: 98b4b0444338
+Create Date: 2026-10-18 23:58:41.274190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2f7b1e9a40'
+down_revision: Union[str, None] = '98b4b0444338'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Concurrent first ratings could insert the same user and anime twice, the newest of them is kept
+    op.execute(
+        'DELETE FROM ratings r USING ratings newer '
+        'WHERE r."userId" = newer."userId" AND r."animeId" = newer."animeId" AND r."ratingId" < newer."ratingId"'
+    )
+    op.create_unique_constraint('uq_user_anime_rating', 'ratings', ['userId', 'animeId'])
+
+    # The duplicates were counted in the rating aggregates, which are rebuilt from the remaining ratings
+    op.execute('DELETE FROM rating_score_counts')
+    op.execute('INSERT INTO rating_score_counts (score, "ratingCount") SELECT score, COUNT(*) FROM ratings GROUP BY score')
+    op.execute('DELETE FROM anime_rating_stats')
+    op.execute(
+        'INSERT INTO anime_rating_stats ("animeId", "ratingCount", "scoreSum", "positiveCount", "positivePercentage") '
+        'SELECT "animeId", COUNT(*), SUM(score), COUNT(*) FILTER (WHERE score > 5), COUNT(*) FILTER (WHERE score > 5) * 100.0 / COUNT(*) '
+        'FROM ratings GROUP BY "animeId"'
+    )
+    op.execute('DELETE FROM user_rating_stats')
+    op.execute(
+        'INSERT INTO user_rating_stats ("userId", "ratingCount", "scoreSum", "positiveCount") '
+        'SELECT "userId", COUNT(*), SUM(score), COUNT(*) FILTER (WHERE score > 5) '
+        'FROM ratings GROUP BY "userId"'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_user_anime_rating', 'ratings', type_='unique')
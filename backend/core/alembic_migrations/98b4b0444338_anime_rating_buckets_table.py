@@ -0,0 +1,43 @@
+"""Anime rating buckets table
+
+Revision ID: 98b4b0444338
+Revises: 3e8edced410f
+Create Date: 2026-10-18 23:12:09.642517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '98b4b0444338'
+down_revision: Union[str, None] = '3e8edced410f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('anime_rating_buckets',
+    sa.Column('animeId', sa.Integer(), nullable=False),
+    sa.Column('bucketStart', sa.DateTime(), nullable=False),
+    sa.Column('ratingCount', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['animeId'], ['anime.animeId'], ),
+    sa.PrimaryKeyConstraint('animeId', 'bucketStart')
+    )
+    op.create_index(op.f('ix_anime_rating_buckets_bucketStart'), 'anime_rating_buckets', ['bucketStart'], unique=False)
+
+    # Hourly counts of the existing ratings, rate_anime adds to the current hour from then on
+    op.execute(
+        'INSERT INTO anime_rating_buckets ("animeId", "bucketStart", "ratingCount") '
+        'SELECT "animeId", date_trunc(\'hour\', created_at), COUNT(*) FROM ratings WHERE created_at IS NOT NULL '
+        'GROUP BY "animeId", date_trunc(\'hour\', created_at)'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_anime_rating_buckets_bucketStart'), table_name='anime_rating_buckets')
+    op.drop_table('anime_rating_buckets')
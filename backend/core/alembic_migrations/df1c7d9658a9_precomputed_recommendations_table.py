@@ -0,0 +1,35 @@
+"""Precomputed recommendations table
+
+Revision ID: df1c7d9658a9
+Revises: e252efc705f5
+Create Date: 2026-10-18 20:40:12.514205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'df1c7d9658a9'
+down_revision: Union[str, None] = 'e252efc705f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('precomputed_recommendations',
+    sa.Column('userId', sa.Integer(), nullable=False),
+    sa.Column('recommendations', sa.ARRAY(sa.Integer()), nullable=False),
+    sa.Column('model_version', sa.String(length=64), nullable=False),
+    sa.Column('generated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['userId'], ['users.userId'], ),
+    sa.PrimaryKeyConstraint('userId')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('precomputed_recommendations')
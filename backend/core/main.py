@@ -1,15 +1,20 @@
 from fastapi import FastAPI, Query, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from .database import get_db
+from .database import get_db, AsyncSessionLocal
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import *
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from .models import *
 from .schemas import *
-from .utils import password_verifier, argon2_pwd_hasher, generate_uuid
+from .utils import password_verifier, argon2_pwd_hasher, generate_uuid, single_flight
 from dotenv import load_dotenv
 import os
 import json
-from recommendation_model.main_ml_model import main_recommendation_model
+import asyncio
+from datetime import datetime, timedelta
+from recommendation_model.main_ml_model import update_served_rating, update_served_watch_lists, latest_model_version, read_model_events
+from recommendation_model.recommendation_cache import get_cached_recommendations, cache_recommendations, invalidate_user_recommendations, recommendation_generation
+from recommendation_model.executor import start_recommender_pool, stop_recommender_pool, recommend_for_user, recommend_next_anime, find_similar_anime, NUMBER_OF_RECOMMENDATIONS
 
 #Testing if application is working
 app = FastAPI(
@@ -38,9 +43,32 @@ app.add_middleware(
     allow_headers = ["*"],
 )
 
+#Recommendation scoring runs in a pool of worker processes that load the models once, at startup
+@app.on_event("startup")
+async def start_recommender():
+    await start_recommender_pool()
+
+@app.on_event("shutdown")
+async def stop_recommender():
+    await stop_recommender_pool()
+
 load_dotenv()
 ADMIN_ID = os.environ.get("ADMIN_ID")
 
+#Anime rows for a list of ids in one IN query, returned in the order of the ids (ranking or list order)
+#Ids with no anime row are skipped, an id repeated in the list gives the anime once
+async def fetch_anime_in_order(db: AsyncSession, anime_ids) -> list:
+
+    anime_ids = list(dict.fromkeys(anime_ids or []))
+
+    if len(anime_ids) == 0:
+        return []
+
+    query = await db.execute(select(Anime).where(Anime.animeId.in_(anime_ids)))
+    anime_by_id = {anime.animeId: anime for anime in query.scalars().all()}
+
+    return [anime_by_id[anime_id] for anime_id in anime_ids if anime_id in anime_by_id]
+
 """User APIs are declared here """
 
 @app.get("/")
@@ -56,12 +84,8 @@ async def get_user_info(user_id: int, db: AsyncSession = Depends(get_db)):
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id: {user_id} does not exist")
     
-    watched_ids = user.watchedAnime
-    watching_ids = user.watchingAnime
-
-    watched_anime_list = await db.execute(select(Anime).where(Anime.animeId.in_(watched_ids))).scalars().all()
-    watching_anime_list = await db.execute(select(Anime).where(Anime.animeId.in_(watching_ids))).scalars().all()
-    
+    watched_anime_list = await fetch_anime_in_order(db, user.watchedAnime)
+    watching_anime_list = await fetch_anime_in_order(db, user.watchingAnime)
 
     userInfobj = UserInfo(
 
@@ -94,37 +118,170 @@ async def get_topn(count: int, db: AsyncSession = Depends(get_db)):
 
     return result
 
-#Returns the top rated anime
+#Top rated leaderboard, materialized in memory from the rating aggregates and rebuilt every LEADERBOARD_REFRESH_SECONDS
+#Anime are ranked by a damped (Bayesian) positivity: their share of positive ratings pulled towards the share over all
+#ratings by LEADERBOARD_PRIOR_WEIGHT virtual ratings, so a couple of positive ratings can't outrank hundreds of mostly positive ones
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", 1000))
+LEADERBOARD_PRIOR_WEIGHT = float(os.environ.get("LEADERBOARD_PRIOR_WEIGHT", 20))
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get("LEADERBOARD_REFRESH_SECONDS", 60))
+
+_leaderboard = {'entries': [], 'expires_at': 0.0}
+
+async def build_leaderboard() -> list:
+
+    async with AsyncSessionLocal() as db:
+
+        #Share of positive ratings over all ratings, from the score histogram
+        query = await db.execute(select(RatingScoreCount.score, RatingScoreCount.ratingCount))
+        score_counts = query.all()
+
+        total = sum(count for _, count in score_counts)
+        prior = sum(count for score, count in score_counts if score > POSITIVE_SCORE) / total if total > 0 else 0.0
+
+        damped_percentage = (AnimeRatingStats.positiveCount + LEADERBOARD_PRIOR_WEIGHT * prior) * 100.0 / (AnimeRatingStats.ratingCount + LEADERBOARD_PRIOR_WEIGHT)
+
+        query = await db.execute(
+
+            select(Anime.animeId, Anime.animeName, Anime.releaseDate, Anime.image_url_base_anime, AnimeRatingStats.ratingCount, AnimeRatingStats.positivePercentage, damped_percentage.label("damped"))
+            .join(AnimeRatingStats, AnimeRatingStats.animeId == Anime.animeId)
+            .where(AnimeRatingStats.ratingCount > 0)
+            .order_by(damped_percentage.desc(), Anime.animeId)
+            .limit(LEADERBOARD_SIZE)
+        )
+
+        rows = query.all()
+
+    return [
+
+        {
+            "animeId": row.animeId,
+            "animeName": row.animeName,
+            "releaseDate": row.releaseDate,
+            "image_url_base_anime": row.image_url_base_anime,
+            "ratingCount": row.ratingCount,
+            "Positivity Percentage": row.positivePercentage,
+            "Ranking Score": float(row.damped),
+        }
+
+        for row in rows
+    ]
+
+async def top_rated_leaderboard() -> list:
+
+    loop_time = asyncio.get_running_loop().time()
+
+    if _leaderboard['expires_at'] <= loop_time:
+
+        #Concurrent requests arriving after expiry share one rebuild
+        _leaderboard['entries'] = await single_flight(('leaderboard',), build_leaderboard)
+        _leaderboard['expires_at'] = loop_time + LEADERBOARD_REFRESH_SECONDS
+
+    return _leaderboard['entries']
+
+#Returns the top rated anime, a page of the leaderboard at a time
 @app.get("/anime/top-rated", status_code=status.HTTP_200_OK)
-async def get_top_rated(db: AsyncSession = Depends(get_db)) -> dict:
+async def get_top_rated(page: int = Query(1, ge=1), page_size: int = Query(10, ge=1, le=100)) -> dict:
     
-    """ The top rated anime would be decided by a custom rating system
+    """ The top rated anime are decided by a custom rating system
     built on the ratings flagged as positive and not positive
 
-    The Rating system would work on the ratio of positive to the total scores
-    where positive score > 5
-
-    Hencee the anime having this ratio as highest, would be flagged as top rated
+    The Rating system works on the ratio of positive to the total scores
+    where positive score > 5, damped towards the ratio over all ratings for
+    anime with few ratings (see LEADERBOARD_PRIOR_WEIGHT)
     """
 
-    sql_query_text = "SELECT animeId, animeName, COUNT(CASE WHEN score > 5 THEN 1 ELSE NULL END) * 100.0 / COUNT(score) AS ratio from anime join ratings using(animeId) group by animeId having count(score) > 0 order by ratio desc limit 1;"
+    leaderboard = await top_rated_leaderboard()
+    start = (page - 1) * page_size
 
-    proc = await db.execute(text(sql_query_text))
-    result = proc.scalars().first()
+    return {"animes": leaderboard[start:start + page_size], "page": page, "page_size": page_size, "total": len(leaderboard)}
 
-    if result is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Anime not found")
-    
+#Trending anime: the most rated over the last 24 hours / 7 days, summed from the hourly rating buckets kept by rate_anime
+#so a request only reads the buckets inside its window, the top TRENDING_SIZE of each window is kept in memory for TRENDING_REFRESH_SECONDS
+TRENDING_WINDOWS = {"24h": 24, "7d": 7 * 24}
+TRENDING_SIZE = int(os.environ.get("TRENDING_SIZE", 100))
+TRENDING_REFRESH_SECONDS = float(os.environ.get("TRENDING_REFRESH_SECONDS", 60))
 
-    dict = {
+_trending = {}
 
-        "animeName" : result.animeName,
-        "releaseDate": result.releaseDate,
-        "image_url_base_anime": result.image_url_base_anime,
-        "Positivity Percentage": result.ratio
-    }
+#Buckets older than the longest window are never read again, a rebuild deletes them once per hour
+_trending_pruned = {'before': None}
 
-    return dict
+def current_hour() -> datetime:
+    return datetime.now().replace(minute=0, second=0, microsecond=0)
+
+async def prune_rating_buckets(db: AsyncSession):
+
+    oldest_read = current_hour() - timedelta(hours=max(TRENDING_WINDOWS.values()) - 1)
+
+    if _trending_pruned['before'] == oldest_read:
+        return
+
+    await db.execute(delete(AnimeRatingBucket).where(AnimeRatingBucket.bucketStart < oldest_read))
+    await db.commit()
+
+    _trending_pruned['before'] = oldest_read
+
+async def build_trending(window: str) -> list:
+
+    #The current, partly elapsed hour and the window's other hours before it
+    window_start = current_hour() - timedelta(hours=TRENDING_WINDOWS[window] - 1)
+    rating_count = func.sum(AnimeRatingBucket.ratingCount)
+
+    async with AsyncSessionLocal() as db:
+
+        await prune_rating_buckets(db)
+
+        query = await db.execute(
+
+            select(AnimeRatingBucket.animeId, rating_count.label("ratingCount"))
+            .where(AnimeRatingBucket.bucketStart >= window_start)
+            .group_by(AnimeRatingBucket.animeId)
+            .order_by(rating_count.desc(), AnimeRatingBucket.animeId)
+            .limit(TRENDING_SIZE)
+        )
+
+        counts = query.all()
+        animeList = await fetch_anime_in_order(db, [anime_id for anime_id, _ in counts])
+
+    rating_counts = dict(counts)
+
+    return [
+
+        {
+            "animeId": anime.animeId,
+            "animeName": anime.animeName,
+            "image_url_base_anime": anime.image_url_base_anime,
+            "ratingCount": int(rating_counts[anime.animeId]),
+        }
+
+        for anime in animeList
+    ]
+
+async def trending_anime(window: str) -> list:
+
+    loop_time = asyncio.get_running_loop().time()
+    expires_at, entries = _trending.get(window, (0.0, []))
+
+    if expires_at <= loop_time:
+        entries = await single_flight(('trending', window), build_trending, window)
+        _trending[window] = (loop_time + TRENDING_REFRESH_SECONDS, entries)
+
+    return entries
+
+@app.get("/anime/trending", status_code=status.HTTP_200_OK)
+async def get_trending(window: str = Query("24h"), limit: int = Query(10, ge=1, le=100)):
+
+    if window not in TRENDING_WINDOWS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Window must be one of {', '.join(TRENDING_WINDOWS)}")
+
+    entries = await trending_anime(window)
+
+    return {"window": window, "animes": entries[:limit]}
+
+#Number of anime in every genre
+@app.get("/anime/genre-distribution", status_code=status.HTTP_200_OK)
+async def get_genre_distribution():
+    return {"Genre_anime_distrib": await cached_genre_anime_distribution()}
 
 #Get all anime
 @app.get("/anime/all", status_code=status.HTTP_200_OK)
@@ -149,6 +306,31 @@ async def get_all_anime(db: AsyncSession = Depends(get_db)):
         )
     return list_of_animes
 
+#Get the anime most similar to one anime from the collaborative filtering neighbour index
+@app.get("/anime/{anime_id}/similar", status_code=status.HTTP_200_OK)
+async def get_similar(anime_id: int, limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db)):
+
+    neighbours = await find_similar_anime(anime_id, limit)
+
+    if neighbours is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No similarity data for anime {anime_id}")
+
+    similarities = dict(neighbours)
+    animeList = await fetch_anime_in_order(db, [neighbour_id for neighbour_id, _ in neighbours])
+
+    similarList = [
+
+        similarAnime(
+            animeId=anime.animeId,
+            animeName=anime.animeName,
+            image_url_base_anime=anime.image_url_base_anime,
+            similarity=similarities[anime.animeId],
+        )
+        for anime in animeList
+    ]
+
+    return similarList
+
 #Get specific anime Info
 @app.get("/anime/{anime_name}", response_model=AnimeGet, status_code=status.HTTP_200_OK)
 async def get_anime_info(anime_name: str, db: AsyncSession = Depends(get_db)):
@@ -237,29 +419,128 @@ async def login(credentials: userLogin, db: AsyncSession = Depends(get_db)):
 
     return loginSuccess(userId=user.userId, userName=user.userName, email=user.email)
 
-#Recommendation model output to be displayed on the recommendation dashboard
-@app.get("/get_recommendations/{user_id}", status_code=status.HTTP_200_OK)
-async def recommendations(user_id: int, db: AsyncSession = Depends(get_db)):
-    
-    recommendation_list = main_recommendation_model(user_id)
-    animeSet = set()
+#Rating aggregates (score histogram, per anime and per user count / sum / positive count) are changed by the
+#difference one rating write makes, inside the transaction of that write. Ratings edited or deleted in the Django admin
+#recount the rows they touch (db_admin_models.signals), python manage.py reconcile_rating_aggregates recounts them all
+POSITIVE_SCORE = 5
+
+async def update_rating_aggregates(db: AsyncSession, user_id: int, anime_id: int, previous_score, score: int):
+
+    added = 1 if previous_score is None else 0
+    score_change = score - (previous_score or 0)
+    positive = int(score > POSITIVE_SCORE)
+    positive_change = positive - int(previous_score is not None and previous_score > POSITIVE_SCORE)
+
+    if previous_score != score:
+
+        if previous_score is not None:
+            await db.execute(update(RatingScoreCount).where(RatingScoreCount.score == previous_score).values(ratingCount=RatingScoreCount.ratingCount - 1))
+
+        statement = pg_insert(RatingScoreCount).values(score=score, ratingCount=1)
+        await db.execute(statement.on_conflict_do_update(index_elements=[RatingScoreCount.score], set_={'ratingCount': RatingScoreCount.ratingCount + 1}))
+
+    #Upserts, the first rating of an anime or of a user creates its row
+    statement = pg_insert(AnimeRatingStats).values(animeId=anime_id, ratingCount=1, scoreSum=score, positiveCount=positive, positivePercentage=positive * 100.0)
+
+    await db.execute(statement.on_conflict_do_update(index_elements=[AnimeRatingStats.animeId], set_={
+
+        'ratingCount': AnimeRatingStats.ratingCount + added,
+        'scoreSum': AnimeRatingStats.scoreSum + score_change,
+        'positiveCount': AnimeRatingStats.positiveCount + positive_change,
+        'positivePercentage': (AnimeRatingStats.positiveCount + positive_change) * 100.0 / (AnimeRatingStats.ratingCount + added),
+    }))
+
+    #A new rating also counts in the trending bucket of the current hour (a rating's created_at is set when it is first written)
+    if added:
+
+        statement = pg_insert(AnimeRatingBucket).values(animeId=anime_id, bucketStart=current_hour(), ratingCount=1)
+        await db.execute(statement.on_conflict_do_update(index_elements=[AnimeRatingBucket.animeId, AnimeRatingBucket.bucketStart], set_={'ratingCount': AnimeRatingBucket.ratingCount + 1}))
+
+    statement = pg_insert(UserRatingStats).values(userId=user_id, ratingCount=1, scoreSum=score, positiveCount=positive)
 
-    for recommendation in recommendation_list:
-        for item in recommendation:
-            animeSet.add(item)
+    await db.execute(statement.on_conflict_do_update(index_elements=[UserRatingStats.userId], set_={
 
-    animeSet = list(animeSet)
-    animeList = []
+        'ratingCount': UserRatingStats.ratingCount + added,
+        'scoreSum': UserRatingStats.scoreSum + score_change,
+        'positiveCount': UserRatingStats.positiveCount + positive_change,
+    }))
 
-    for item in animeSet:
+def rating_stats(stats) -> dict:
 
-        query = await db.execute(select(Anime).where(Anime.animeId == item))
-        result = query.scalars().first()
-        animeList.append(result)
+    if stats is None or stats.ratingCount == 0:
+        return {"ratingCount": 0, "averageScore": None, "Positivity Percentage": None}
 
-    #For ratings distribution
-    query2 = await db.execute(select(Rating.score, func.count(Rating.score).label("ratingCount")).group_by(Rating.score).order_by(Rating.score))
-    result2 = query2.all()
+    return {
+
+        "ratingCount": stats.ratingCount,
+        "averageScore": stats.scoreSum / stats.ratingCount,
+        "Positivity Percentage": stats.positiveCount * 100.0 / stats.ratingCount,
+    }
+
+#Rating count, average score and share of positive ratings of one anime / one user, read from the rating aggregates
+@app.get("/anime/{anime_id}/rating-stats", status_code=status.HTTP_200_OK)
+async def get_anime_rating_stats(anime_id: int, db: AsyncSession = Depends(get_db)):
+
+    stats = await db.get(AnimeRatingStats, anime_id)
+
+    return {"animeId": anime_id, **rating_stats(stats)}
+
+@app.get("/user/{user_id}/rating-stats", status_code=status.HTTP_200_OK)
+async def get_user_rating_stats(user_id: int, db: AsyncSession = Depends(get_db)):
+
+    stats = await db.get(UserRatingStats, user_id)
+
+    return {"userId": user_id, **rating_stats(stats)}
+
+#Rating an anime, a user rating the same anime again updates the existing rating
+@app.post("/rate_anime", status_code=status.HTTP_200_OK)
+async def rate_anime(ratingData: RatingCreateModel, db: AsyncSession = Depends(get_db)):
+
+    query = await db.execute(select(Anime.animeId).where(Anime.animeId == ratingData.animeId))
+
+    if query.scalars().first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Anime {ratingData.animeId} not found")
+
+    try:
+
+        #A first rating is inserted, uq_user_anime_rating makes a concurrent first rating of the same anime wait for
+        #this one and then find it, so only one of them counts as new in the aggregates
+        statement = pg_insert(Rating).values(userId=ratingData.userId, animeId=ratingData.animeId, score=ratingData.score, review_text=ratingData.reviewText)
+        query2 = await db.execute(statement.on_conflict_do_nothing(index_elements=[Rating.userId, Rating.animeId]).returning(Rating.ratingId))
+        previous_score = None
+
+        #Otherwise the existing rating is locked so that a concurrent re-rating can't read the same previous score
+        if query2.scalars().first() is None:
+
+            query3 = await db.execute(select(Rating).where(Rating.userId == ratingData.userId).where(Rating.animeId == ratingData.animeId).with_for_update())
+            rating = query3.scalars().first()
+            previous_score = rating.score
+
+            rating.score = ratingData.score
+            rating.review_text = ratingData.reviewText if ratingData.reviewText is not None else rating.review_text
+
+        await update_rating_aggregates(db, ratingData.userId, ratingData.animeId, previous_score, ratingData.score)
+        await db.commit()
+
+    except Exception as e:
+        print(f"Error rating anime {ratingData.animeId} for user {ratingData.userId}: {e}") # Log error for debugging
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Rating couldn't be saved")
+
+    #Only the anime pairs touched by this rating are recomputed in the served model
+    update_served_rating(ratingData.userId, ratingData.animeId, ratingData.score)
+    invalidate_user_recommendations(ratingData.userId)
+
+    return {'message': "Anime rated successfully", 'score': ratingData.score}
+
+#Aggregates shown on the recommendation dashboard, the same for every user
+#Each opens its own session so that concurrent dashboard requests can share one run of it (see single_flight)
+async def ratings_distribution() -> dict:
+
+    #Read from the score histogram kept by rate_anime, one row per score
+    async with AsyncSessionLocal() as db:
+
+        query2 = await db.execute(select(RatingScoreCount.score, RatingScoreCount.ratingCount).where(RatingScoreCount.ratingCount > 0).order_by(RatingScoreCount.score))
+        result2 = query2.all()
 
     ratings_distrib = {}
 
@@ -270,47 +551,134 @@ async def recommendations(user_id: int, db: AsyncSession = Depends(get_db)):
         print(f"{key} ----> {values}")
     
     print()
-    #For genre_anime_distribution
-    query3 = await db.execute(select(Anime.genres))
-    result3 = query3.scalars().all()
 
-    genre_anime_distribution = {}
+    return ratings_distrib
 
-    for result in result3:
-        
-        for id in result:
+async def genre_anime_distribution() -> list:
 
-            if id in genre_anime_distribution:
-                genre_anime_distribution[id] += 1
-            else:
-                genre_anime_distribution[id] = 1
+    #One pass in the database: every anime's genre ids unnested, counted per genre and joined to the genre names
+    anime_genre_ids = select(func.unnest(Anime.genres).label("genreId")).subquery()
 
-    genre_anime_distributionList = []
-    for id, count in genre_anime_distribution.items():
-        newQuery = await db.execute(select(Genre.name).where(Genre.genreId == id))
-        result = newQuery.scalars().all()
+    query = (
 
-        for name in result:
-            genre_anime_distributionList.append({name: count})
-    
-    sql_query_text = "SELECT \"animeId\", \"animeName\", \"releaseDate\", COUNT(CASE WHEN score > 5 THEN 1 ELSE NULL END) * 100.0 / COUNT(score) AS \"ratio\", \"image_url_base_anime\" from anime join ratings using(\"animeId\") group by \"animeId\" having count(score) > 0 order by ratio desc limit 1;"
+        select(Genre.name, func.count().label("animeCount"))
+        .join(anime_genre_ids, anime_genre_ids.c.genreId == Genre.genreId)
+        .group_by(Genre.genreId, Genre.name)
+        .order_by(func.count().desc(), Genre.name)
+    )
 
-    proc = await db.execute(text(sql_query_text))
-    result = proc.all()
+    async with AsyncSessionLocal() as db:
 
-    if result is None:
+        result3 = await db.execute(query)
+        genre_anime_distributionList = [{name: count} for name, count in result3.all()]
+
+    return genre_anime_distributionList
+
+#The genre distribution only changes when anime are added or edited, so it is kept until then
+#Anime are added and edited in the Django admin, which publishes an anime_genres event to the served model's journal
+#(db_admin_models.signals), a new model version or such an event drops the cached distribution
+_genre_distribution = {'value': None, 'generation': 0, 'model_version': None, 'journal_offset': 0}
+
+def invalidate_genre_anime_distribution():
+
+    _genre_distribution['value'] = None
+    _genre_distribution['generation'] += 1
+
+def _sync_genre_distribution():
+
+    model_version = latest_model_version()
+
+    if model_version != _genre_distribution['model_version']:
+        invalidate_genre_anime_distribution()
+        _genre_distribution['model_version'] = model_version
+        _genre_distribution['journal_offset'] = 0
+
+    if model_version is None:
+        return
+
+    events, _genre_distribution['journal_offset'] = read_model_events(model_version, _genre_distribution['journal_offset'])
+
+    if any(event['type'] == 'anime_genres' for event in events):
+        invalidate_genre_anime_distribution()
+
+async def cached_genre_anime_distribution() -> list:
+
+    _sync_genre_distribution()
+
+    if _genre_distribution['value'] is None:
+
+        generation = _genre_distribution['generation']
+        value = await single_flight(('genre_anime_distribution',), genre_anime_distribution)
+
+        #Not kept if anime changed while it was being computed
+        if generation == _genre_distribution['generation']:
+            _genre_distribution['value'] = value
+
+        return value
+
+    return _genre_distribution['value']
+
+async def most_popular_anime() -> dict:
+
+    #First place of the top rated leaderboard
+    leaderboard = await top_rated_leaderboard()
+
+    if len(leaderboard) == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Anime not found")
-    
 
     dict = {
 
-        "animeName" : result[0][1],
-        "releaseDate": result[0][2],
-        "image_url_base_anime": result[0][4],
-        "Positivity Percentage": result[0][3],
+        "animeName" : leaderboard[0]["animeName"],
+        "releaseDate": leaderboard[0]["releaseDate"],
+        "image_url_base_anime": leaderboard[0]["image_url_base_anime"],
+        "Positivity Percentage": leaderboard[0]["Positivity Percentage"],
     }
 
-    return {"recommendations": animeList, "ratings_distribution": ratings_distrib, "Genre_anime_distrib": genre_anime_distributionList, "most_popular_anime": dict, "message": f"Great Recommendations are generated for {user_id}"}
+    return dict
+
+async def user_recommendations(user_id: int):
+
+    cached = get_cached_recommendations(user_id)
+
+    if cached is not None:
+        return cached, []
+
+    #A rating or watch list change while the recommenders run makes the result stale, it is then served but not cached
+    generation = recommendation_generation(user_id)
+
+    #Watched and watching anime are filtered out by the ranking stage
+    async with AsyncSessionLocal() as db:
+
+        query = await db.execute(select(User.watchedAnime, User.watchingAnime, User.locationId).where(User.userId == user_id))
+        user_lists = query.first()
+
+    excluded_ids = (user_lists[0] or []) + (user_lists[1] or []) if user_lists is not None else []
+    location_id = user_lists[2] if user_lists is not None else None
+
+    #A user with too few ratings (just signed up) gets the popular anime of their location
+    ranked_ids, ranked_scores, timed_out_recommenders = await recommend_for_user(user_id, excluded_ids, location_id=location_id)
+
+    #Partial results of a request where a recommender timed out are not cached
+    if not timed_out_recommenders:
+        cache_recommendations(user_id, ranked_ids, generation)
+
+    return ranked_ids, timed_out_recommenders
+
+#Recommendation model output to be displayed on the recommendation dashboard
+@app.get("/get_recommendations/{user_id}", status_code=status.HTTP_200_OK)
+async def recommendations(user_id: int, db: AsyncSession = Depends(get_db)):
+    
+    #Concurrent requests for the same user and model version (double clicks, several tabs) share one computation
+    ranked_ids, timed_out_recommenders = await single_flight(('recommendations', user_id, latest_model_version()), user_recommendations, user_id)
+
+    #Anime in ranked order, best recommendation first
+    animeList = await fetch_anime_in_order(db, ranked_ids)
+
+    ratings_distrib = await single_flight(('ratings_distribution',), ratings_distribution)
+    genre_anime_distributionList = await cached_genre_anime_distribution()
+    dict = await most_popular_anime()
+
+    return {"recommendations": animeList, "ratings_distribution": ratings_distrib, "Genre_anime_distrib": genre_anime_distributionList, "most_popular_anime": dict, "timed_out_recommenders": timed_out_recommenders, "message": f"Great Recommendations are generated for {user_id}"}
 
 #For admin side APIs where ADMIN_ID is fetched from env to prevent unauthorized access
 @app.post("/add_season", status_code=status.HTTP_200_OK)
@@ -399,6 +767,36 @@ async def get_states(db: AsyncSession = Depends(get_db)):
 
 #APIs for watching and watched anime
 
+#After a watched / watching list change, the served models and the cached recommendations of the user follow the new lists
+#The session recommender's next anime for the new watching list go straight into the user's cached recommendations,
+#ahead of the ones cached before, so the change shows on the next read without running every recommender again
+async def watch_lists_changed(user: User):
+
+    watched, watching = list(user.watchedAnime or []), list(user.watchingAnime or [])
+
+    #Read before the change is published, replaying it empties the user's cache entry
+    previous = get_cached_recommendations(user.userId)
+
+    update_served_watch_lists(user.userId, watched, watching)
+    invalidate_user_recommendations(user.userId)
+
+    #Without a cached list the next read runs the full pipeline, which includes the session recommender
+    if previous is None or len(watching) == 0:
+        return
+
+    #Taken after this change is replayed, so only a later write stops the merged list from being cached
+    generation = recommendation_generation(user.userId)
+
+    next_anime = await recommend_next_anime(user.userId, watching, watched + watching)
+
+    if next_anime is None:
+        return
+
+    excluded_ids = set(watched) | set(watching)
+    recommendations = list(dict.fromkeys(next_anime + [anime_id for anime_id in previous if anime_id not in excluded_ids]))
+
+    cache_recommendations(user.userId, recommendations[:NUMBER_OF_RECOMMENDATIONS], generation)
+
 @app.patch("/add-to-watched-list/", status_code=status.HTTP_200_OK)
 async def add_to_watched_list(animeListUpdate: AnimeListUpdate, db: AsyncSession = Depends(get_db)):
 
@@ -428,6 +826,8 @@ async def add_to_watched_list(animeListUpdate: AnimeListUpdate, db: AsyncSession
         print(f"Error adding to watched list for user: {e}") # Log error for debugging
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Anime couldn't be added to watchedlist")
     
+    await watch_lists_changed(results)
+
     return {'message': "Anime added successfully to watch List"}
 
 @app.patch("/add-to-watching-list/", status_code=status.HTTP_200_OK)
@@ -459,6 +859,8 @@ async def add_to_watching_list(animeListUpdate: AnimeListUpdate, db: AsyncSessio
         print(f"Error adding to watching list for user {animeListUpdate.userId}: {e}") # Log error for debugging
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Anime couldn't be added to watching list")
     
+    await watch_lists_changed(results)
+
     return {'message': "Anime added successfully to watching List"}
 
 
@@ -487,6 +889,8 @@ async def remove_from_watched_list(animeListUpdate: AnimeListUpdate, db: AsyncSe
         print(f"Error adding to watching list for user {animeListUpdate.userId}: {e}") # Log error for debugging
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Anime couldn't be removed to watching list")
     
+    await watch_lists_changed(results)
+
     return {'message': "Anime removed successfully from watched List"}
 
 
@@ -514,6 +918,8 @@ async def remove_from_watching_list(animeListUpdate: AnimeListUpdate, db: AsyncS
         print(f"Error adding to watching list for user {animeListUpdate.userId}: {e}") # Log error for debugging
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Anime couldn't be removed to watching list")
     
+    await watch_lists_changed(results)
+
     return {'message': "Anime removed successfully from watching List"}
 
 
@@ -528,8 +934,7 @@ async def user_profile(user_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"User not found")
     
 
-    query2 = await db.execute(select(Anime).where(Anime.animeId.in_(result.watchedAnime)))
-    result2 = query2.scalars().all()
+    result2 = await fetch_anime_in_order(db, result.watchedAnime)
 
     watchedList = []
 
@@ -545,8 +950,7 @@ async def user_profile(user_id: int, db: AsyncSession = Depends(get_db)):
             )
         )
 
-    query3 = await db.execute(select(Anime).where(Anime.animeId.in_(result.watchingAnime)))
-    result3 = query3.scalars().all()
+    result3 = await fetch_anime_in_order(db, result.watchingAnime)
 
     watchingList = []
     for item in result3:
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, ARRAY, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, ARRAY, UniqueConstraint, BigInteger, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import PrimaryKeyConstraint # For composite primary keys
 from datetime import datetime
@@ -67,6 +67,11 @@ class Rating(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now) 
     review_text = Column(String(1000))
 
+    # One rating per user and anime, rate_anime's upsert and the rating aggregates rely on it
+    __table_args__ = (
+        UniqueConstraint('userId', 'animeId', name='uq_user_anime_rating'),
+    )
+
     # Relationships to User and Anime models
     user_data = relationship("User", back_populates="ratings")
     anime_data = relationship("Anime", back_populates="ratings")
@@ -88,4 +93,39 @@ class User(Base):
     location = relationship("Location")
 
     # Relationship to Rating model (to fetch ratings made by this user)
-    ratings = relationship("Rating", back_populates="user_data")
\ No newline at end of file
+    ratings = relationship("Rating", back_populates="user_data")
+
+class PrecomputedRecommendation(Base):
+    __tablename__ = "precomputed_recommendations"
+    userId = Column(Integer, ForeignKey("users.userId"), primary_key=True)
+    recommendations = Column(ARRAY(Integer), nullable=False) # Ranked anime ids written by the nightly batch run
+    model_version = Column(String(64), nullable=False) # Artifact version the recommendations were scored with
+    generated_at = Column(DateTime, default=datetime.now)
+
+# --- Rating aggregates, updated in the same transaction as every rating write (see rate_anime) ---
+
+class RatingScoreCount(Base):
+    __tablename__ = "rating_score_counts"
+    score = Column(Integer, primary_key=True)
+    ratingCount = Column(Integer, nullable=False, default=0) # Ratings currently holding this score
+
+class AnimeRatingStats(Base):
+    __tablename__ = "anime_rating_stats"
+    animeId = Column(Integer, ForeignKey("anime.animeId"), primary_key=True)
+    ratingCount = Column(Integer, nullable=False, default=0)
+    scoreSum = Column(BigInteger, nullable=False, default=0)
+    positiveCount = Column(Integer, nullable=False, default=0) # Ratings with score > 5
+    positivePercentage = Column(Float, nullable=False, default=0.0, index=True) # positiveCount * 100 / ratingCount, indexed for the most popular anime
+
+class UserRatingStats(Base):
+    __tablename__ = "user_rating_stats"
+    userId = Column(Integer, ForeignKey("users.userId"), primary_key=True)
+    ratingCount = Column(Integer, nullable=False, default=0)
+    scoreSum = Column(BigInteger, nullable=False, default=0)
+    positiveCount = Column(Integer, nullable=False, default=0) # Ratings with score > 5
+
+class AnimeRatingBucket(Base):
+    __tablename__ = "anime_rating_buckets"
+    animeId = Column(Integer, ForeignKey("anime.animeId"), primary_key=True)
+    bucketStart = Column(DateTime, primary_key=True, index=True) # Start of the hour the ratings were created in
+    ratingCount = Column(Integer, nullable=False, default=0)
@@ -176,6 +176,12 @@ class browseAnime(BaseModel):
     image_url_base_anime: Optional[str]
     model_config = ConfigDict(from_attributes=True)
 
+class similarAnime(BaseModel):
+    animeId: int
+    animeName: str
+    image_url_base_anime: Optional[str]
+    similarity: float
+
 class SeasonsCreate(BaseModel):
     animeId: int
     seasonNumber: int = Field(..., description="The sequential number of the season for that anime (e.g., 1, 2, 3)")
@@ -28,4 +28,33 @@ def generate_uuid(id_list):
         else: 
             break
     
-    return id_uuid
\ No newline at end of file
+    return id_uuid
+
+"""Utility3: Single flight coalescing of identical concurrent calls """
+
+import asyncio
+
+#Key -> task of the call currently running for that key
+_in_flight = {}
+
+async def single_flight(key, function, *args):
+
+    """Runs function(*args) once for all concurrent callers passing the same key, they all get its result (or its error)
+    The next call after it finished runs it again, so nothing is cached beyond the calls that overlapped
+    """
+
+    task = _in_flight.get(key)
+
+    if task is None:
+
+        task = asyncio.ensure_future(function(*args))
+        _in_flight[key] = task
+
+        def forget(done_task):
+            if _in_flight.get(key) is done_task:
+                del _in_flight[key]
+
+        task.add_done_callback(forget)
+
+    #shield: a caller that disconnects stops waiting but does not cancel the call the others are waiting on
+    return await asyncio.shield(task)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class DbAdminModelsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'db_admin_models'
+
+    def ready(self):
+
+        #Connects the receivers that publish anime changes to the recommendation models
+        from . import signals
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from db_admin_models.rating_aggregates import reconcile_rating_aggregates
+
+class Command(BaseCommand):
+
+    help = "Recounts the rating histogram and the per anime / per user rating stats from the ratings table"
+
+    def handle(self, *args, **options):
+
+        with transaction.atomic():
+            scores, anime, users = reconcile_rating_aggregates()
+
+        self.stdout.write(f"Recounted {scores} scores, {anime} anime and {users} users")
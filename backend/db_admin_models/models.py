@@ -89,6 +89,7 @@ class Ratings(models.Model):
     class Meta:
         managed = False
         db_table = 'ratings'
+        unique_together = (('userid', 'animeid'),) # One rating per user and anime, enforced by uq_user_anime_rating
     
     def __str__(self):
         return f"{self.ratingid}"
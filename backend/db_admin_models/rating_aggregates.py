@@ -0,0 +1,72 @@
+""" Recounts of the rating aggregates (core.models RatingScoreCount, AnimeRatingStats, UserRatingStats) from the ratings table
+
+The API changes the aggregates by the difference of every rating it writes (core.main.update_rating_aggregates).
+Ratings edited or deleted here in the admin recount the rows they touch instead, and
+python manage.py reconcile_rating_aggregates recounts every row
+"""
+
+from django.db import connection
+
+POSITIVE_SCORE = 5
+
+#The aggregate rows are locked first, so a rating the API commits meanwhile is either in the recount or added after it
+LOCK_SCORES = 'SELECT 1 FROM rating_score_counts WHERE score = ANY(%s) FOR UPDATE'
+LOCK_ANIME = 'SELECT 1 FROM anime_rating_stats WHERE "animeId" = ANY(%s) FOR UPDATE'
+LOCK_USERS = 'SELECT 1 FROM user_rating_stats WHERE "userId" = ANY(%s) FOR UPDATE'
+
+#Ids without any rating left get a row of zeros, the same as what the API's difference updates leave behind
+RECOUNT_SCORES = '''
+    INSERT INTO rating_score_counts (score, "ratingCount")
+    SELECT ids.id, COUNT(r.score) FROM unnest(%s::int[]) AS ids(id) LEFT JOIN ratings r ON r.score = ids.id GROUP BY ids.id
+    ON CONFLICT (score) DO UPDATE SET "ratingCount" = EXCLUDED."ratingCount"
+'''
+
+RECOUNT_ANIME = f'''
+    INSERT INTO anime_rating_stats ("animeId", "ratingCount", "scoreSum", "positiveCount", "positivePercentage")
+    SELECT ids.id, COUNT(r.score), COALESCE(SUM(r.score), 0), COUNT(*) FILTER (WHERE r.score > {POSITIVE_SCORE}),
+        COALESCE(COUNT(*) FILTER (WHERE r.score > {POSITIVE_SCORE}) * 100.0 / NULLIF(COUNT(r.score), 0), 0)
+    FROM unnest(%s::int[]) AS ids(id) LEFT JOIN ratings r ON r."animeId" = ids.id GROUP BY ids.id
+    ON CONFLICT ("animeId") DO UPDATE SET "ratingCount" = EXCLUDED."ratingCount", "scoreSum" = EXCLUDED."scoreSum",
+        "positiveCount" = EXCLUDED."positiveCount", "positivePercentage" = EXCLUDED."positivePercentage"
+'''
+
+RECOUNT_USERS = f'''
+    INSERT INTO user_rating_stats ("userId", "ratingCount", "scoreSum", "positiveCount")
+    SELECT ids.id, COUNT(r.score), COALESCE(SUM(r.score), 0), COUNT(*) FILTER (WHERE r.score > {POSITIVE_SCORE})
+    FROM unnest(%s::int[]) AS ids(id) LEFT JOIN ratings r ON r."userId" = ids.id GROUP BY ids.id
+    ON CONFLICT ("userId") DO UPDATE SET "ratingCount" = EXCLUDED."ratingCount", "scoreSum" = EXCLUDED."scoreSum",
+        "positiveCount" = EXCLUDED."positiveCount"
+'''
+
+def recount_rating_aggregates(scores, anime_ids, user_ids):
+
+    """ Recounts the histogram rows of scores and the stats of anime_ids and user_ids, inside the caller's transaction """
+
+    scores, anime_ids, user_ids = sorted(set(scores)), sorted(set(anime_ids)), sorted(set(user_ids))
+
+    with connection.cursor() as cursor:
+
+        for lock, recount, ids in ((LOCK_SCORES, RECOUNT_SCORES, scores), (LOCK_ANIME, RECOUNT_ANIME, anime_ids), (LOCK_USERS, RECOUNT_USERS, user_ids)):
+
+            if len(ids) > 0:
+                cursor.execute(lock, [ids])
+                cursor.execute(recount, [ids])
+
+def reconcile_rating_aggregates():
+
+    """ Recounts every aggregate row, writers of the aggregates wait until it is done """
+
+    with connection.cursor() as cursor:
+
+        cursor.execute('LOCK TABLE rating_score_counts, anime_rating_stats, user_rating_stats IN SHARE ROW EXCLUSIVE MODE')
+
+        cursor.execute('SELECT score FROM rating_score_counts UNION SELECT DISTINCT score FROM ratings')
+        scores = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT "animeId" FROM anime_rating_stats UNION SELECT DISTINCT "animeId" FROM ratings')
+        anime_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT "userId" FROM user_rating_stats UNION SELECT DISTINCT "userId" FROM ratings')
+        user_ids = [row[0] for row in cursor.fetchall()]
+
+    recount_rating_aggregates(scores, anime_ids, user_ids)
+
+    return len(scores), len(anime_ids), len(user_ids)
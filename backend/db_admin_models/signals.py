@@ -0,0 +1,42 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Anime, Ratings
+from .rating_aggregates import recount_rating_aggregates
+from recommendation_model.main_ml_model import update_served_anime_genres
+
+#Anime are added and edited through the Django admin, the served content based model and the API's cached
+#genre distribution only see the change through the event published here
+
+@receiver(post_save, sender=Anime)
+def anime_saved(sender, instance, **kwargs):
+
+    update_served_anime_genres(instance.animeid, instance.genres or [])
+
+@receiver(post_delete, sender=Anime)
+def anime_deleted(sender, instance, **kwargs):
+
+    #Without genres the anime matches no user profile anymore
+    update_served_anime_genres(instance.animeid, [])
+
+#Ratings edited or deleted in the admin bypass the API, so the aggregate rows of the rating before and after the
+#change are recounted, in the admin's transaction
+
+@receiver(pre_save, sender=Ratings)
+def rating_saving(sender, instance, **kwargs):
+
+    instance._previous = Ratings.objects.filter(pk=instance.pk).values('score', 'animeid_id', 'userid_id').first() if instance.pk else None
+
+@receiver(post_save, sender=Ratings)
+def rating_saved(sender, instance, **kwargs):
+
+    ratings = [{'score': instance.score, 'animeid_id': instance.animeid_id, 'userid_id': instance.userid_id}]
+
+    if getattr(instance, '_previous', None) is not None:
+        ratings.append(instance._previous)
+
+    recount_rating_aggregates([rating['score'] for rating in ratings], [rating['animeid_id'] for rating in ratings], [rating['userid_id'] for rating in ratings])
+
+@receiver(post_delete, sender=Ratings)
+def rating_deleted(sender, instance, **kwargs):
+
+    recount_rating_aggregates([instance.score], [instance.animeid_id], [instance.userid_id])
@@ -1,69 +1,145 @@
-""" Recommendation method 2: Using Association Rule Mining using watched Anime list of user as well as watching Anime List"""
+""" Recommendation method 2: Using Association Rule Mining using watched Anime list of user as well as watching Anime List
 
-import os, sys, django, ast
-import pandas as pd
-from mlxtend.frequent_patterns import association_rules, apriori
-from mlxtend.preprocessing import TransactionEncoder
+Rules are mined from sparse co-occurrence counts of the watch lists: for every pair of anime watched together
+support(A, B) = users who watched both / users with a watch history, and the rule A -> B has confidence count(A, B) / count(A)
+The rules are indexed by antecedent, so recommending for a user is one dictionary probe per watched anime
+"""
 
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-sys.path.append(PROJECT_ROOT)
+import numpy as np
+from scipy import sparse
+from .scoring import no_recommendations
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+#Same thresholds the apriori based miner used
+MIN_SUPPORT = 0.4
+MIN_CONFIDENCE = 0.4
 
-#Use a transaction encoder to transform the lists into transaction matrix, where transc is row and all animeIds are columns
+def build_watch_matrix(transactions):
 
-def association_recommender(user_id, users_df, anime_df, number_of_recommendations):
+    """ Users x anime boolean CSR matrix of the watch lists, anime get compact codes (their position in anime_ids) """
 
-    te = TransactionEncoder()
-    transactions = users_df[users_df['watchedAnime'].apply(lambda x: len(x) > 0)]['watchedAnime'].tolist()
+    lengths = np.array([len(transaction) for transaction in transactions], dtype=np.int64)
+    watched = np.concatenate([np.asarray(transaction, dtype=np.int64) for transaction in transactions])
 
-    if transactions is None:
+    anime_ids, anime_codes = np.unique(watched, return_inverse=True)
+    user_codes = np.repeat(np.arange(len(transactions)), lengths)
+
+    watch_matrix = sparse.csr_matrix(
+
+        (np.ones(len(watched), dtype=np.float32), (user_codes, anime_codes)),
+        shape=(len(transactions), len(anime_ids)),
+    )
+
+    #A watch list containing the same anime twice still counts it once
+    watch_matrix.data[:] = 1.0
+
+    return watch_matrix, anime_ids
+
+def build_association_model(users_df):
+
+    #Watched list of every user, kept with the rules so that scoring does not need the users table
+    user_watched_animes = {
+
+        int(user_id): [int(anime_id) for anime_id in watched] for user_id, watched in zip(users_df['userId'], users_df['watchedAnime'])
+        if isinstance(watched, (list, np.ndarray))
+    }
+
+    transactions = [watched for watched in user_watched_animes.values() if len(watched) > 0]
+
+    if len(transactions) == 0:
         print(f"No user watch history found")
-        return []
+        return {'rules': {}, 'user_watched_animes': user_watched_animes}
+
+    watch_matrix, anime_ids = build_watch_matrix(transactions)
+    number_of_transactions = len(transactions)
+
+    #A pair is never watched by more users than either of its anime, so anime below the support threshold are dropped
+    #before the pairs are counted and the co-occurrence matrix only spans the frequent anime
+    item_counts = np.asarray(watch_matrix.sum(axis=0)).ravel()
+    frequent_anime = item_counts / number_of_transactions >= MIN_SUPPORT
+
+    if not frequent_anime.any():
+        print(f"No rules generated")
+        return {'rules': {}, 'user_watched_animes': user_watched_animes}
+
+    watch_matrix, anime_ids, item_counts = watch_matrix[:, frequent_anime], anime_ids[frequent_anime], item_counts[frequent_anime]
+
+    #Co-occurrence counts of every pair of frequent anime
+    co_occurrence = (watch_matrix.T.tocsr() @ watch_matrix).tocoo()
 
-    te_array = te.fit(transactions).transform(transactions)
-    transactions_df = pd.DataFrame(te_array, columns=te.columns_)
+    antecedents, consequents, pair_counts = co_occurrence.row, co_occurrence.col, co_occurrence.data
 
-    frequent_itemsets = apriori(transactions_df, min_support=0.4, use_colnames=True)
+    confidence = pair_counts / item_counts[antecedents]
+    lift = confidence / (item_counts[consequents] / number_of_transactions)
 
-    if frequent_itemsets.empty:
-        print(f"No item sets found")
-        return []
-    
-    rules = association_rules(frequent_itemsets, min_threshold=0.4, metric="Confidence")
+    frequent_rules = (antecedents != consequents) & (pair_counts / number_of_transactions >= MIN_SUPPORT) & (confidence >= MIN_CONFIDENCE)
 
-    if rules.empty:
+    if not frequent_rules.any():
         print(f"No rules generated")
-        return []
+        return {'rules': {}, 'user_watched_animes': user_watched_animes}
+
+    antecedents, consequents = antecedents[frequent_rules], consequents[frequent_rules]
+    confidence, lift = confidence[frequent_rules], lift[frequent_rules]
+
+    #Group the rules by antecedent, strongest rule first inside every group
+    order = np.lexsort((-lift, -confidence, antecedents))
+    antecedents, consequents, confidence = antecedents[order], consequents[order], confidence[order]
+
+    group_starts = np.flatnonzero(np.r_[True, antecedents[1:] != antecedents[:-1]])
+    group_ends = np.r_[group_starts[1:], len(antecedents)]
+
+    rules = {
+
+        int(anime_ids[antecedents[start]]): (anime_ids[consequents[start:end]].astype(np.int32), confidence[start:end].astype(np.float32))
+        for start, end in zip(group_starts, group_ends)
+    }
+
+    print(f"Mined {len(antecedents)} association rules over {len(rules)} anime")
+
+    return {'rules': rules, 'user_watched_animes': user_watched_animes}
+
+def recommend_association_scored(model, user_id, number_of_recommendations):
+
+    """ Anime the rules of the user's watched anime point to as (anime ids, best rule confidence) arrays, best first """
+
+    rules = model['rules']
+
+    if len(rules) == 0:
+        return no_recommendations()
 
-    rules = rules.sort_values(by=['confidence', 'list'], ascending=False)
     #Get list of anime watched by the required user
-    user_watched_animes = users_df[users_df['userId'] == user_id]['watchedAnime']
+    user_watched_animes = model['user_watched_animes'].get(user_id, [])
 
-    if user_watched_animes.empty:
+    if len(user_watched_animes) == 0:
         print(f"User with {user_id} has not watched any animes yet")
-        return []
+        return no_recommendations()
 
-    #Frozen set so that list is immutable    
+    #Frozen set so that list is immutable
     user_watched_animes = frozenset(user_watched_animes)
 
-    #Initialize a empty set to get the recommended ids
-    recommended_animeIds = set()
+    fired_rules = [rules[watched_anime] for watched_anime in user_watched_animes if watched_anime in rules]
+
+    if len(fired_rules) == 0:
+        return no_recommendations()
+
+    consequents = np.concatenate([consequents for consequents, _ in fired_rules]).astype(np.int64)
+    confidences = np.concatenate([confidences for _, confidences in fired_rules]).astype(np.float64)
+
+    keep = ~np.isin(consequents, np.fromiter(user_watched_animes, dtype=np.int64))
+    consequents, confidences = consequents[keep], confidences[keep]
+
+    #Best confidence of every anime that a rule of a watched anime points to: highest first within each anime, keep the first
+    order = np.lexsort((-confidences, consequents))
+    consequents, confidences = consequents[order], confidences[order]
 
-    for index, row in rules.iterrows():
-        antecedent = row['antecedents']
-        consequent = row['consequents']
+    first = np.r_[True, consequents[1:] != consequents[:-1]] if len(consequents) > 0 else np.array([], dtype=bool)
+    consequents, confidences = consequents[first], confidences[first]
 
-        if antecedent.issubset(user_watched_animes):
-            for recommend in consequent:
+    order = np.lexsort((consequents, -confidences))[:number_of_recommendations]
 
-                if recommend not in user_watched_animes:
-                    recommended_animeIds.add(recommend)
+    return consequents[order], confidences[order]
 
-            if len(recommended_animeIds) > number_of_recommendations:
-                break 
-        
-    final_recommendation = list(recommended_animeIds)[:number_of_recommendations]
+def recommend_association(model, user_id, number_of_recommendations):
 
-    return final_recommendation
+    recommended_ids, _ = recommend_association_scored(model, user_id, number_of_recommendations)
 
+    return [int(anime_id) for anime_id in recommended_ids]
@@ -4,65 +4,425 @@ i.e if many people like anime A, and those same people like anime B as well, the
 Anime A, would be recommended anime B as well
 """
 
-from sklearn.metrics.pairwise import cosine_similarity
-import os, django, sys, ast
-import pandas as pd
+import os
+import numpy as np
+from scipy import sparse
+from .scoring import top_n_positions, top_n_positions_per_row, no_recommendations, scored_recommendations
 
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-sys.path.append(PROJECT_ROOT)
+#Number of most similar anime kept per anime in the neighbour index
+NUMBER_OF_NEIGHBOURS = int(os.getenv('RECOMMENDER_NEIGHBOURS', 50))
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
-django.setup()
+#Dot rows changed by rating writes are folded back into the CSR dot matrix once this many have piled up
+DOT_ROWS_COMPACT_AT = int(os.getenv('RECOMMENDER_DOT_ROWS_COMPACT_AT', 1024))
 
-def collaborative_recommender(user_id, ratings_df, anime_df, number_of_recommendations):
-    
-    print(f"Generating Recommendation for User using IBCF technique based on cosine similarity")
+def build_user_item_csr(ratings_df):
 
-    """Converts ratings df into a matrix where columns are userIds and columns are animeIds
-    Hence a cell of this matrix gives us the score given by the particular userId to the particular anime
+    """Builds the users x anime score matrix straight from the (userId, animeId, score) columns as a CSR matrix
+    Users and anime get compact integer codes (their position in user_ids / anime_ids), so no dense pivot table is created
     """
-    
-    user_item_matrix = ratings_df.pivot_table(index='userId', columns='animeId', values='score')
 
-    #We transpose the matrix and if some user has not rated that anime then we set rating to 0 (Default)
-    anime_features = user_item_matrix.T.fillna(0)
+    #Same as pivot_table, a user rating the same anime twice counts with the mean score
+    scores = ratings_df.groupby(['userId', 'animeId'], sort=False)['score'].mean()
 
-    """ Calculates cosine similarity matrix for each anime entry"""
-    item_similarity_matrix = cosine_similarity(anime_features)
+    user_ids, user_codes = np.unique(scores.index.get_level_values('userId').to_numpy(), return_inverse=True)
+    anime_ids, anime_codes = np.unique(scores.index.get_level_values('animeId').to_numpy(), return_inverse=True)
 
-    item_similarity_df = pd.DataFrame(
+    user_item_matrix = sparse.csr_matrix(
 
-        item_similarity_matrix,
-        index=anime_features.index,
-        columns=anime_features.index
+        (scores.to_numpy(dtype=np.float32), (user_codes, anime_codes)),
+        shape=(len(user_ids), len(anime_ids)),
     )
 
-    print(f"Item similarity is: \n {item_similarity_df}")
+    return user_item_matrix, user_ids, anime_ids
 
-    #Returns anime ids that a particluar user has already rated
-    user_rated_animes = ratings_df[ratings_df['userId']==user_id]['animeId']
+def top_neighbours(position, columns, dots, item_norms_sq, k):
 
-    if user_rated_animes.empty:
-        print(f"{user_id} has not rated any animes yet")
-        return []
-    
+    """Turns one row of dot products into the K best cosine neighbours of that anime, best first
+    cos(a, b) = dot(a, b) / (|a| * |b|), and an anime is never its own neighbour
+    """
+
+    keep = columns != position
+    columns, dots = columns[keep], dots[keep]
+
+    norm_products = np.sqrt(item_norms_sq[position] * item_norms_sq[columns])
+    similarities = np.divide(dots, norm_products, out=np.zeros_like(dots, dtype=np.float64), where=norm_products > 0)
+
+    #Pairs never co-rated carry no information
+    keep = similarities > 0
+    columns, similarities = columns[keep], similarities[keep]
+
+    if len(columns) > k:
+        top = np.argpartition(-similarities, k - 1)[:k]
+        columns, similarities = columns[top], similarities[top]
+
+    order = np.argsort(-similarities, kind='stable')
+
+    return columns[order], similarities[order]
+
+def build_neighbour_index(item_dots, item_norms_sq, number_of_neighbours=NUMBER_OF_NEIGHBOURS):
+
+    """Picks the top K most similar anime of every anime out of the sparse co-rated dot products (item_dots)
+    Scoring only reads this index, but item_dots itself has one entry per co-rated pair, up to N x N for a dense catalog
+    Rows of neighbour_ids / neighbour_scores are anime positions, unused slots hold -1 with score 0
+    """
+
+    number_of_items = item_dots.shape[0]
+    k = max(min(number_of_neighbours, number_of_items - 1), 0)
+
+    neighbour_ids = np.full((number_of_items, k), -1, dtype=np.int32)
+    neighbour_scores = np.zeros((number_of_items, k), dtype=np.float32)
+
+    for position in range(number_of_items):
+
+        row_slice = slice(item_dots.indptr[position], item_dots.indptr[position + 1])
+        columns, similarities = top_neighbours(position, item_dots.indices[row_slice], item_dots.data[row_slice], item_norms_sq, k)
+
+        neighbour_ids[position, :len(columns)] = columns
+        neighbour_scores[position, :len(columns)] = similarities
+
+    return neighbour_ids, neighbour_scores
+
+def build_collaborative_model(ratings_df, number_of_neighbours=NUMBER_OF_NEIGHBOURS):
+
+    print(f"Building top {number_of_neighbours} neighbour index for IBCF technique based on cosine similarity")
+
+    user_item_matrix, user_ids, anime_ids = build_user_item_csr(ratings_df)
+
+    """Dot products between the score columns of every co-rated pair of anime (the diagonal holds each anime's squared norm)
+    These are kept in the model so a new rating can adjust the affected pairs without recomputing everything.
+    That is the price of incremental updates: the artifact (and every process serving it) holds one entry per
+    co-rated pair, several times the top K index and growing towards N x N, instead of building it block-wise and dropping it
+    """
+    item_dots = (user_item_matrix.T.tocsr() @ user_item_matrix).tocsr()
+    item_norms_sq = item_dots.diagonal().astype(np.float64)
+
+    neighbour_ids, neighbour_scores = build_neighbour_index(item_dots, item_norms_sq, number_of_neighbours)
+
+    #Positions and scores of the anime rated by every user, so that scoring a user does not need the ratings table anymore
+    user_ratings = {
+
+        int(user_id): (user_item_matrix.indices[start:end].astype(np.int32), user_item_matrix.data[start:end].copy())
+        for user_id, start, end in zip(user_ids, user_item_matrix.indptr[:-1], user_item_matrix.indptr[1:])
+    }
+
+    return {
+
+        'anime_ids': anime_ids,
+        'anime_index': {int(anime_id): position for position, anime_id in enumerate(anime_ids)},
+        'neighbour_ids': neighbour_ids,
+        'neighbour_scores': neighbour_scores,
+        'number_of_neighbours': neighbour_ids.shape[1],
+        'item_dots': item_dots,
+        'item_norms_sq': item_norms_sq,
+        'updated_dot_rows': {},
+        'user_ratings': user_ratings,
+    }
+
+""" Incremental updates: a new or changed rating only touches the pairs between the rated anime and the user's other anime """
+
+def _dot_row_arrays(model, position):
+
+    """ Columns and dot products of one anime's current dot row, read without copying it """
+
+    row = model['updated_dot_rows'].get(position)
+
+    if row is not None:
+        return np.fromiter(row.keys(), dtype=np.int64, count=len(row)), np.fromiter(row.values(), dtype=np.float64, count=len(row))
+
+    item_dots = model['item_dots']
+
+    if position >= item_dots.shape[0]:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
 
-    print(f"User has reviewed around {len(user_rated_animes)} animes")
+    row_slice = slice(item_dots.indptr[position], item_dots.indptr[position + 1])
 
-    recommendation_scores = pd.Series(0.0, index=item_similarity_df.index)
+    return item_dots.indices[row_slice].astype(np.int64), item_dots.data[row_slice].astype(np.float64)
 
-    for rated_anime in user_rated_animes:
-        #We get similarity score column for all animes that the user has rated
-        similarities = item_similarity_df[rated_anime]
-        recommendation_scores = recommendation_scores.add(similarities, fill_value=0)
+def _dot_row(model, position):
 
+    """ Dot products of one anime with every co-rated anime as {position: dot}, copied out of item_dots the first time it changes """
+
+    updated_dot_rows = model['updated_dot_rows']
+
+    if position not in updated_dot_rows:
+        columns, dots = _dot_row_arrays(model, position)
+        updated_dot_rows[position] = dict(zip(columns.tolist(), dots.tolist()))
+
+    return updated_dot_rows[position]
+
+def _compact_dot_rows(model):
+
+    """ Folds the changed dot rows back into item_dots, so the dict of copied rows stays bounded under a steady stream of ratings """
+
+    item_dots, updated_dot_rows = model['item_dots'].tocoo(), model['updated_dot_rows']
+    number_of_items = len(model['anime_ids'])
+
+    #Unchanged rows as they are, then the changed rows in full
+    keep = ~np.isin(item_dots.row, np.fromiter(updated_dot_rows.keys(), dtype=np.int64, count=len(updated_dot_rows)))
+    rows, columns, dots = [item_dots.row[keep]], [item_dots.col[keep]], [item_dots.data[keep]]
+
+    for position, row in updated_dot_rows.items():
+        rows.append(np.full(len(row), position, dtype=np.int64))
+        columns.append(np.fromiter(row.keys(), dtype=np.int64, count=len(row)))
+        dots.append(np.fromiter(row.values(), dtype=np.float64, count=len(row)))
+
+    model['item_dots'] = sparse.csr_matrix(
+
+        (np.concatenate(dots).astype(item_dots.dtype), (np.concatenate(rows), np.concatenate(columns))),
+        shape=(number_of_items, number_of_items),
+    )
+
+    updated_dot_rows.clear()
+
+def _add_anime(model, anime_id):
+
+    #An anime nobody had rated at training time gets a new position at the end of every array
+    position = len(model['anime_ids'])
+    k = model['number_of_neighbours']
+
+    model['anime_ids'] = np.append(model['anime_ids'], anime_id)
+    model['anime_index'][anime_id] = position
+    model['neighbour_ids'] = np.vstack([model['neighbour_ids'], np.full((1, k), -1, dtype=np.int32)])
+    model['neighbour_scores'] = np.vstack([model['neighbour_scores'], np.zeros((1, k), dtype=np.float32)])
+    model['item_norms_sq'] = np.append(model['item_norms_sq'], 0.0)
+
+    return position
+
+def _refresh_neighbours(model, position):
+
+    """ Recomputes the K best neighbours of an anime from its whole dot row """
+
+    columns, dots = _dot_row_arrays(model, position)
+    neighbour_columns, similarities = top_neighbours(position, columns, dots, model['item_norms_sq'], model['number_of_neighbours'])
+
+    model['neighbour_ids'][position] = -1
+    model['neighbour_scores'][position] = 0.0
+    model['neighbour_ids'][position, :len(neighbour_columns)] = neighbour_columns
+    model['neighbour_scores'][position, :len(neighbour_columns)] = similarities
+
+def _set_neighbour(model, position, neighbour, similarity):
+
+    """ Writes one changed similarity into the K best neighbours of an anime and keeps the row sorted """
+
+    neighbour_ids = model['neighbour_ids'][position]
+    neighbour_scores = model['neighbour_scores'][position]
+
+    if len(neighbour_ids) == 0:
+        return
+
+    existing = np.flatnonzero(neighbour_ids == neighbour)
+
+    if len(existing) > 0:
+        slot = existing[0]
+
+    #Otherwise it can only replace the weakest neighbour (or a free slot, which always sorts last)
+    elif similarity > 0 and (neighbour_ids[-1] == -1 or neighbour_scores[-1] < similarity):
+        slot = len(neighbour_ids) - 1
+
+    else:
+        return
+
+    if similarity > 0:
+        neighbour_ids[slot], neighbour_scores[slot] = neighbour, similarity
     else:
-        print(f"Warning: Rated anime ID {rated_anime} by User {user_id} not found in similarity matrix.")
-    
-    recommendation_scores = recommendation_scores[~recommendation_scores.index.isin(user_rated_animes)]
-    recommendations_sorted = recommendation_scores.sort_values(ascending=False)
-    top_n_recommended_anime_ids = recommendations_sorted.head(number_of_recommendations).index.tolist()
+        neighbour_ids[slot], neighbour_scores[slot] = -1, 0.0
+
+    order = np.argsort(-neighbour_scores, kind='stable')
+    neighbour_ids[:] = neighbour_ids[order]
+    neighbour_scores[:] = neighbour_scores[order]
+
+def apply_rating_update(model, user_id, anime_id, score):
+
+    """Applies one inserted or updated rating to the collaborative model in place
+    Only the anime's norm and its dot products with the other anime this user rated change, but the new norm changes
+    the anime's similarity with every anime it was co-rated with, so all of those neighbour rows are checked
+    """
+
+    position = model['anime_index'].get(anime_id)
+
+    if position is None:
+        position = _add_anime(model, anime_id)
+
+    rated_positions, rated_scores = model['user_ratings'].get(user_id, (np.array([], dtype=np.int32), np.array([], dtype=np.float32)))
+    match = np.flatnonzero(rated_positions == position)
+
+    old_score = float(rated_scores[match[0]]) if len(match) > 0 else 0.0
+    score_change = score - old_score
+
+    if score_change == 0:
+        return
+
+    if len(match) > 0:
+        rated_scores = rated_scores.copy()
+        rated_scores[match[0]] = score
+    else:
+        rated_positions = np.append(rated_positions, np.int32(position))
+        rated_scores = np.append(rated_scores, np.float32(score))
+
+    model['user_ratings'][user_id] = (rated_positions, rated_scores)
+
+    item_norms_sq = model['item_norms_sq']
+    item_norms_sq[position] += score ** 2 - old_score ** 2
+
+    row = _dot_row(model, position)
+    row[position] = item_norms_sq[position]
+
+    #dot(a, b) gains score_change * (this user's score of b) for every other anime b the user rated
+    for other, other_score in zip(rated_positions.tolist(), rated_scores.tolist()):
+
+        if other == position:
+            continue
+
+        row[other] = row.get(other, 0.0) + score_change * other_score
+        other_row = _dot_row(model, other)
+        other_row[position] = row[other]
+
+    #The anime's own neighbours are recomputed from its (sparse) dot row
+    _refresh_neighbours(model, position)
+
+    #New similarity of the anime with every anime it is co-rated with
+    columns, dots = _dot_row_arrays(model, position)
+    keep = columns != position
+    columns, dots = columns[keep], dots[keep]
+
+    norm_products = np.sqrt(item_norms_sq[position] * item_norms_sq[columns])
+    similarities = np.divide(dots, norm_products, out=np.zeros_like(dots), where=norm_products > 0)
+
+    #A row only changes if the anime is one of its K neighbours, or now beats its weakest one (or fills a free slot)
+    neighbour_ids, neighbour_scores = model['neighbour_ids'][columns], model['neighbour_scores'][columns]
+    listed = neighbour_ids == position
+    is_listed = listed.any(axis=1)
+    listed_scores = np.where(listed, neighbour_scores, 0.0).sum(axis=1)
+
+    if neighbour_ids.shape[1] > 0:
+        enters = (similarities > 0) & ((neighbour_ids[:, -1] == -1) | (neighbour_scores[:, -1] < similarities))
+        full = neighbour_ids[:, -1] != -1
+    else:
+        enters = full = np.zeros(len(columns), dtype=bool)
+
+    #A listed anime that got less similar in a full row may drop below the best anime left out, which only the whole dot row knows
+    refresh = is_listed & full & (similarities < listed_scores)
+
+    for other in columns[refresh].tolist():
+        _refresh_neighbours(model, other)
+
+    changed = (is_listed | enters) & ~refresh
+
+    for other, similarity in zip(columns[changed].tolist(), similarities[changed].tolist()):
+        _set_neighbour(model, other, position, similarity)
+
+    if len(model['updated_dot_rows']) >= DOT_ROWS_COMPACT_AT:
+        _compact_dot_rows(model)
+
+def similar_anime(model, anime_id, number_of_results):
+
+    """ Returns (animeId, similarity) pairs of the nearest neighbours of one anime, best first """
+
+    position = model['anime_index'].get(anime_id)
+
+    if position is None:
+        return None
+
+    neighbours = model['neighbour_ids'][position]
+    scores = model['neighbour_scores'][position]
+    valid = neighbours >= 0
+
+    return [
+
+        (int(model['anime_ids'][neighbour]), float(score))
+        for neighbour, score in zip(neighbours[valid][:number_of_results], scores[valid][:number_of_results])
+    ]
+
+def recommend_collaborative_scored(model, user_id, number_of_recommendations):
+
+    """ Best anime for the user as (anime ids, summed neighbour similarity) arrays, best first """
+
+    anime_ids = model['anime_ids']
+
+    #Returns positions of the anime that a particluar user has already rated
+    rated_positions, rated_scores = model['user_ratings'].get(user_id, (np.array([], dtype=np.int32), None))
+
+    if len(rated_positions) == 0:
+        print(f"{user_id} has not rated any animes yet")
+        return no_recommendations()
+
+    print(f"User has reviewed around {len(rated_positions)} animes")
+
+    #Gather the K neighbours of every rated anime and add their similarities onto one score per anime
+    neighbours = model['neighbour_ids'][rated_positions]
+    valid = neighbours >= 0
+
+    #Only anime nobody else rated (or K = 0): every score would be 0, which says nothing
+    if not valid.any():
+        print(f"None of the animes rated by {user_id} has a neighbour")
+        return no_recommendations()
+
+    recommendation_scores = np.bincount(
+
+        neighbours[valid],
+        weights=model['neighbour_scores'][rated_positions][valid],
+        minlength=len(anime_ids),
+    ).astype(np.float64)
+
+    #Already rated anime can never be recommended
+    recommendation_scores[rated_positions] = -np.inf
+
+    top_positions = top_n_positions(recommendation_scores, number_of_recommendations)
+
+    return scored_recommendations(anime_ids, top_positions, recommendation_scores)
+
+def recommend_collaborative(model, user_id, number_of_recommendations):
+
+    recommended_ids, _ = recommend_collaborative_scored(model, user_id, number_of_recommendations)
+
+    return [int(anime_id) for anime_id in recommended_ids]
+
+def neighbour_matrix(model):
+
+    """ The neighbour index as a sparse N x N matrix, so many users can be scored with one matrix-matrix product """
+
+    neighbour_ids = model['neighbour_ids']
+    valid = neighbour_ids >= 0
+    rows = np.repeat(np.arange(len(neighbour_ids)), neighbour_ids.shape[1]).reshape(neighbour_ids.shape)
+
+    return sparse.csr_matrix(
+
+        (model['neighbour_scores'][valid], (rows[valid], neighbour_ids[valid])),
+        shape=(len(neighbour_ids), len(neighbour_ids)),
+    )
+
+def recommend_collaborative_block(model, user_ids, number_of_recommendations, neighbours=None):
+
+    """Scores a block of users at once: (users x anime rated indicator) . (anime x anime neighbour matrix)
+    Returns one (anime ids, scores) pair per user, like recommend_collaborative_scored
+    """
+
+    anime_ids = model['anime_ids']
+    neighbours = neighbour_matrix(model) if neighbours is None else neighbours
+
+    rows, columns = [], []
+
+    for row, user_id in enumerate(user_ids):
+        rated_positions = model['user_ratings'].get(user_id, (np.array([], dtype=np.int32), None))[0]
+        rows.append(np.full(len(rated_positions), row, dtype=np.int64))
+        columns.append(rated_positions.astype(np.int64))
+
+    rows, columns = np.concatenate(rows), np.concatenate(columns)
+
+    rated_matrix = sparse.csr_matrix(
+
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(user_ids), len(anime_ids)),
+    )
+
+    recommendation_scores = (rated_matrix @ neighbours).toarray()
+    recommendation_scores[rows, columns] = -np.inf
 
-    return top_n_recommended_anime_ids
+    top_positions = top_n_positions_per_row(recommendation_scores, number_of_recommendations)
 
+    #Same as the single user path, users without ratings or whose rated anime have no neighbour get no collaborative recommendations
+    return [
 
+        scored_recommendations(anime_ids, positions, row_scores) if (row_scores > 0).any() else no_recommendations()
+        for positions, row_scores in zip(top_positions, recommendation_scores)
+    ]
@@ -1,67 +1,191 @@
-""" Recommender 3 using Content based filtering on Anime Genre and which animes are adult rated """
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+""" Recommender 3 using Content based filtering on Anime Genre and which animes are adult rated
 
+The genre feature matrix (TF-IDF weighted, l2 normalised, sparse float32, one row per animeId) is built once with the model
+and only rebuilt when an anime's genres change, so scoring a user is one sparse mean and one sparse dot product
+"""
 import numpy as np
-import os, django, ast, sys
+from scipy import sparse
+from .scoring import top_n_positions, top_n_positions_per_row, no_recommendations, scored_recommendations
+from .ann_index import USE_ANN, build_lsh_index, query_lsh_index
 
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-sys.path.append(PROJECT_ROOT)
+def compute_genre_matrix(anime_genres):
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
-django.setup()
+    """TF-IDF weighting of the binary anime x genre matrix, same formula as sklearn's TfidfVectorizer defaults
+    idf = ln((1 + number of anime) / (1 + anime having the genre)) + 1, then every row is scaled to unit length
+    """
 
-def content_based_recommender(user_id, ratings_df, anime_df, number_of_recommendations):
-    
-    anime_df['genres_for_tfidf'] = anime_df['genres'].apply(
-        lambda x: ' '.join(map(str, x)) if isinstance(x, list) and len(x) > 0 else ''
-    )
-    #anime_df['genres'] = anime_df['genres'].fillna('')
+    number_of_anime = anime_genres.shape[0]
+    document_frequency = np.bincount(anime_genres.indices, minlength=anime_genres.shape[1])
+    idf = np.log((1 + number_of_anime) / (1 + document_frequency)) + 1
+
+    weighted = (anime_genres @ sparse.diags(idf)).tocsr()
+
+    row_norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    inverse_norms = np.divide(1.0, row_norms, out=np.zeros_like(row_norms), where=row_norms > 0)
+
+    return (sparse.diags(inverse_norms) @ weighted).tocsr().astype(np.float32)
+
+def build_content_model(ratings_df, anime_df):
+
+    anime_ids = anime_df['animeId'].to_numpy()
+    genre_lists = [[int(genre) for genre in genres] if isinstance(genres, (list, np.ndarray)) else [] for genres in anime_df['genres']]
+
+    genre_ids = np.unique(np.array([genre for genres in genre_lists for genre in genres], dtype=np.int64))
+    genre_index = {int(genre_id): column for column, genre_id in enumerate(genre_ids)}
+
+    rows = np.repeat(np.arange(len(anime_ids)), [len(genres) for genres in genre_lists])
+    columns = np.array([genre_index[genre] for genres in genre_lists for genre in genres], dtype=np.int64)
+
+    anime_genres = sparse.csr_matrix((np.ones(len(columns), dtype=np.float32), (rows, columns)), shape=(len(anime_ids), len(genre_ids)))
+
+    #Every anime a user rated and the ones rated above 6, which build the user's genre profile
+    user_rated_animes = ratings_df.groupby('userId')['animeId'].apply(list).to_dict()
+    user_liked_animes = ratings_df[ratings_df['score'] > 6].groupby('userId')['animeId'].apply(list).to_dict()
+
+    genre_matrix = compute_genre_matrix(anime_genres)
+
+    return {
+
+        'anime_ids': anime_ids,
+        'anime_index': {int(anime_id): position for position, anime_id in enumerate(anime_ids)},
+        'genre_index': genre_index,
+        'anime_genres': anime_genres,
+        'genre_matrix': genre_matrix,
+        'ann_index': build_lsh_index(genre_matrix),
+        'user_rated_animes': user_rated_animes,
+        'user_liked_animes': user_liked_animes,
+    }
+
+def update_anime_genres(model, anime_id, genres):
+
+    """ Sets the genres of a new or edited anime and rebuilds the weighted matrix, the only time it is recomputed """
+
+    genre_index = model['genre_index']
+
+    for genre in genres:
+        if genre not in genre_index:
+            genre_index[genre] = len(genre_index)
+
+    anime_genres = model['anime_genres'].tolil()
+    anime_genres.resize((anime_genres.shape[0], len(genre_index)))
+
+    position = model['anime_index'].get(anime_id)
+
+    if position is None:
+        position = anime_genres.shape[0]
+        anime_genres.resize((position + 1, len(genre_index)))
+        model['anime_ids'] = np.append(model['anime_ids'], anime_id)
+        model['anime_index'][anime_id] = position
+
+    anime_genres.rows[position] = sorted({genre_index[genre] for genre in genres})
+    anime_genres.data[position] = [1.0] * len(anime_genres.rows[position])
+
+    model['anime_genres'] = anime_genres.tocsr()
+    model['genre_matrix'] = compute_genre_matrix(model['anime_genres'])
+    model['ann_index'] = build_lsh_index(model['genre_matrix'])
+
+def _positions(model, anime_ids):
 
-    tfid_vector = TfidfVectorizer(stop_words='english', token_pattern=r'(?u)\b\w+\b')
-    anime_genre_matrix = tfid_vector.fit_transform(anime_df['genres_for_tfidf'])
+    anime_index = model['anime_index']
 
-    anime_genre_df = pd.DataFrame(anime_genre_matrix.toarray(), index=anime_df['animeId'], columns = tfid_vector.get_feature_names_out())
+    return np.array([anime_index[aid] for aid in anime_ids if aid in anime_index], dtype=np.int64)
 
-    user_ratings = ratings_df[ratings_df['userId']==user_id]
- 
-    if user_ratings is None:
+def recommend_content_based_scored(model, user_id, number_of_recommendations, use_ann=USE_ANN):
+
+    """ Anime closest to the user's liked genre profile as (anime ids, cosine similarity) arrays, best first """
+
+    genre_matrix = model['genre_matrix']
+
+    user_watched_anime_ids = model['user_rated_animes'].get(user_id, [])
+
+    if len(user_watched_anime_ids) == 0:
         print(f"User has not given any ratings yet")
-        return []
+        return no_recommendations()
 
-    liked_anime_ids = user_ratings[user_ratings['score'] > 6]
+    liked_anime_ids = model['user_liked_animes'].get(user_id, [])
 
-    if liked_anime_ids is None:
+    if len(liked_anime_ids) == 0:
         print(f"User has not rated any animes above 6 yet")
-        return []
+        return no_recommendations()
 
-    existing_liked_anime_ids = [aid for aid in liked_anime_ids if aid in anime_genre_df.index]
+    liked_positions = _positions(model, liked_anime_ids)
 
-    if existing_liked_anime_ids is None:
+    if len(liked_positions) == 0:
         print(f"None of the anime user rated are in the anime genre matrix")
-        return []
-
-    liked_anime_genres = anime_genre_df.loc[existing_liked_anime_ids]
+        return no_recommendations()
 
-    user_profile = liked_anime_genres.mean(axis=0)
+    user_profile = np.asarray(genre_matrix[liked_positions].mean(axis=0)).ravel()
+    profile_norm = np.linalg.norm(user_profile)
 
-    if user_profile.sum() == 0:
+    if profile_norm == 0:
         print(f"Cannot generate recommendation")
-        return []
+        return no_recommendations()
+
+    query = user_profile / profile_norm
+    watched_positions = _positions(model, user_watched_anime_ids)
+
+    #Only the anime in the profile's LSH buckets are scored, the exact path still answers when they are too few
+    if use_ann:
+
+        top_positions, top_scores = query_lsh_index(model['ann_index'], genre_matrix, query, number_of_recommendations, watched_positions)
+
+        if len(top_positions) == number_of_recommendations:
+            return np.asarray(model['anime_ids'][top_positions], dtype=np.int64), top_scores
+
+    #Rows of the genre matrix are unit length, so this dot product is the cosine similarity to every anime
+    similarities = genre_matrix @ query
+    similarities[watched_positions] = -np.inf
+
+    top_positions = top_n_positions(similarities, number_of_recommendations)
 
+    return scored_recommendations(model['anime_ids'], top_positions, similarities)
 
-    user_profile_reshaped = user_profile.values.reshape(1, -1)
-    similarities = cosine_similarity(user_profile_reshaped, anime_genre_df)[0]
+def recommend_content_based(model, user_id, number_of_recommendations, use_ann=USE_ANN):
 
-    anime_similarity_scores = pd.Series(similarities, index=anime_genre_df.index)
+    recommended_ids, _ = recommend_content_based_scored(model, user_id, number_of_recommendations, use_ann)
+
+    return [int(anime_id) for anime_id in recommended_ids]
+
+def recommend_content_based_block(model, user_ids, number_of_recommendations):
+
+    """Scores a block of users at once: mean liked genre rows as one sparse product, then cosine against every anime
+    Returns one (anime ids, scores) pair per user, like recommend_content_based_scored
+    """
+
+    genre_matrix = model['genre_matrix']
+    number_of_anime = genre_matrix.shape[0]
+
+    liked_rows, liked_columns, liked_weights, rated_rows, rated_columns = [], [], [], [], []
+
+    for row, user_id in enumerate(user_ids):
+
+        liked_positions = _positions(model, model['user_liked_animes'].get(user_id, []))
+        liked_rows.append(np.full(len(liked_positions), row, dtype=np.int64))
+        liked_columns.append(liked_positions)
+        liked_weights.append(np.full(len(liked_positions), 1.0 / max(len(liked_positions), 1), dtype=np.float32))
+
+        rated_positions = _positions(model, model['user_rated_animes'].get(user_id, []))
+        rated_rows.append(np.full(len(rated_positions), row, dtype=np.int64))
+        rated_columns.append(rated_positions)
+
+    liked_matrix = sparse.csr_matrix(
+
+        (np.concatenate(liked_weights), (np.concatenate(liked_rows), np.concatenate(liked_columns))),
+        shape=(len(user_ids), number_of_anime),
+    )
+    user_profiles = (liked_matrix @ genre_matrix).toarray()
 
-    user_watched_anime_ids = user_ratings['animeId'].tolist()
+    profile_norms = np.linalg.norm(user_profiles, axis=1, keepdims=True)
+    user_profiles = np.divide(user_profiles, profile_norms, out=np.zeros_like(user_profiles), where=profile_norms > 0)
 
-    unwatched_anime_scores = anime_similarity_scores[~anime_similarity_scores.index.isin(user_watched_anime_ids)]
+    similarities = np.asarray(genre_matrix @ user_profiles.T).T
+    similarities[np.concatenate(rated_rows), np.concatenate(rated_columns)] = -np.inf
 
-    recommendations_sorted = unwatched_anime_scores.sort_values(ascending=False)
+    top_positions = top_n_positions_per_row(similarities, number_of_recommendations)
 
-    top_n_recommended_anime_ids = recommendations_sorted.head(number_of_recommendations).index.tolist()
+    #Users without a liked anime or with an empty genre profile get nothing, same as the single user path
+    return [
 
-    return top_n_recommended_anime_ids
+        scored_recommendations(model['anime_ids'], positions, row_similarities) if profile_norm > 0 else no_recommendations()
+        for positions, row_similarities, profile_norm in zip(top_positions, similarities, profile_norms[:, 0])
+    ]
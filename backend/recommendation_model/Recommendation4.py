@@ -0,0 +1,249 @@
+""" Recommender 4 using Matrix Factorization of the ratings with Alternating Least Squares
+
+Every user and every anime gets a vector of NUMBER_OF_FACTORS latent factors, learnt so that
+dot(user factors, anime factors) approximates the user's score minus the mean score. ALS alternates between solving
+all user vectors with the anime vectors fixed and the other way round, each a batch of small k x k linear systems
+
+Scoring a user is one dot product of their vector against the anime factor matrix. The factor matrices are saved as
+float32 .npy files in the artifact and memory-mapped by the serving processes (see model_artifact.py)
+"""
+
+import os
+import numpy as np
+from scipy import sparse
+from .scoring import top_n_positions, top_n_positions_per_row, no_recommendations, scored_recommendations
+from .Recommendation1 import build_user_item_csr
+from .ann_index import USE_ANN, build_lsh_index, query_lsh_index
+
+NUMBER_OF_FACTORS = int(os.getenv('RECOMMENDER_FACTORS', 32))
+ALS_ITERATIONS = int(os.getenv('RECOMMENDER_ALS_ITERATIONS', 10))
+ALS_REGULARIZATION = float(os.getenv('RECOMMENDER_ALS_REGULARIZATION', 0.1))
+
+#Rows solved per batch, bounds the (rows x k x k) normal equation tensor to a few MB
+ALS_BLOCK_SIZE = 4096
+
+#Ratings per batch, and the most fixed vectors whose outer products are kept at once: bounds the (x k x k) outer
+#product tensor the Gram matrices are summed from to 64 MB at 32 factors
+ALS_BLOCK_RATINGS = 16384
+
+def _row_blocks(indptr, max_rows, max_ratings):
+
+    """ (start, end) row ranges of at most max_rows rows and max_ratings ratings, a row with more ratings is a block of its own """
+
+    number_of_rows, start = len(indptr) - 1, 0
+
+    while start < number_of_rows:
+
+        end = min(start + max_rows, number_of_rows, int(np.searchsorted(indptr, indptr[start] + max_ratings, side='right')) - 1)
+        end = max(end, start + 1)
+
+        yield start, end
+        start = end
+
+def _outer_products(factors):
+    return (factors[:, :, None] * factors[:, None, :]).reshape(len(factors), -1)
+
+def _gram_matrices(ratings, fixed_factors, fixed_outer, start, end):
+
+    """F_r^T F_r of every row r in [start, end), as a sparse product of the block's rating pattern with outer products
+    fixed_outer holds the outer product of every fixed vector when that fits in a block's budget, otherwise the outer
+    products of the block's own rated columns are built here, one per rating
+    """
+
+    number_of_factors = fixed_factors.shape[1]
+    first, last = ratings.indptr[start], ratings.indptr[end]
+
+    if fixed_outer is not None:
+        columns, outer = ratings.indices[first:last], fixed_outer
+
+    #One heavy row (a popular anime on the item half step) never materialises its outer products
+    elif end - start == 1:
+        rated_factors = fixed_factors[ratings.indices[first:last]]
+        return (rated_factors.T @ rated_factors)[None, :, :]
+
+    #Every rating gets a column of its own, rows without ratings get a zero matrix
+    else:
+        columns, outer = np.arange(last - first), _outer_products(fixed_factors[ratings.indices[first:last]])
+
+    rating_pattern = sparse.csr_matrix(
+
+        (np.ones(last - first, dtype=np.float32), columns, ratings.indptr[start:end + 1] - first),
+        shape=(end - start, len(outer)),
+    )
+
+    return (rating_pattern @ outer).reshape(end - start, number_of_factors, number_of_factors)
+
+def solve_factors(ratings, fixed_factors, regularization):
+
+    """One ALS half step: the factors of every row of ratings (a CSR matrix of centered scores) with fixed_factors held still
+    Row r solves (F_r^T F_r + regularization * n_r * I) x = F_r^T s_r, where F_r are the fixed factors of the columns it rated
+    Memory is bounded by the block sizes, not by the number of rows on the fixed side
+    """
+
+    number_of_rows, number_of_factors = ratings.shape[0], fixed_factors.shape[1]
+    counts = np.diff(ratings.indptr)
+
+    factors = np.zeros((number_of_rows, number_of_factors), dtype=np.float32)
+    identity = np.eye(number_of_factors, dtype=np.float64)
+
+    #A small fixed side (the anime when solving the users) has its outer products computed once for all blocks
+    fixed_outer = _outer_products(fixed_factors) if len(fixed_factors) <= ALS_BLOCK_RATINGS else None
+
+    for start, end in _row_blocks(ratings.indptr, ALS_BLOCK_SIZE, ALS_BLOCK_RATINGS):
+
+        gram = _gram_matrices(ratings, fixed_factors, fixed_outer, start, end).astype(np.float64)
+        gram += regularization * np.maximum(counts[start:end], 1)[:, None, None] * identity
+        right_hand_side = np.asarray(ratings[start:end] @ fixed_factors, dtype=np.float64)
+
+        factors[start:end] = np.linalg.solve(gram, right_hand_side[:, :, None])[:, :, 0]
+
+    return factors
+
+def build_factor_model(ratings_df, number_of_factors=NUMBER_OF_FACTORS, iterations=ALS_ITERATIONS, regularization=ALS_REGULARIZATION):
+
+    user_item_matrix, user_ids, anime_ids = build_user_item_csr(ratings_df)
+
+    print(f"Learning {number_of_factors} latent factors for {len(user_ids)} users and {len(anime_ids)} anime with ALS")
+
+    mean_score = float(user_item_matrix.data.mean()) if user_item_matrix.nnz > 0 else 0.0
+
+    centered = user_item_matrix.copy()
+    centered.data -= mean_score
+    centered_by_anime = centered.T.tocsr()
+
+    rng = np.random.default_rng(0)
+    item_factors = (rng.standard_normal((len(anime_ids), number_of_factors)) * 0.1).astype(np.float32)
+
+    for _ in range(iterations):
+
+        user_factors = solve_factors(centered, item_factors, regularization)
+        item_factors = solve_factors(centered_by_anime, user_factors, regularization)
+
+    return {
+
+        'user_ids': user_ids,
+        'user_index': {int(user_id): position for position, user_id in enumerate(user_ids)},
+        'anime_ids': anime_ids,
+        'anime_index': {int(anime_id): position for position, anime_id in enumerate(anime_ids)},
+        'mean_score': mean_score,
+        'regularization': regularization,
+
+        #Saved as .npy files and memory-mapped read only when served
+        'user_factors': user_factors,
+        'item_factors': item_factors,
+        'ann_index': build_lsh_index(item_factors),
+
+        #Anime every user rated, as CSR parts: user row r rated rating_positions[rating_indptr[r]:rating_indptr[r + 1]]
+        'rating_indptr': user_item_matrix.indptr.astype(np.int64),
+        'rating_positions': user_item_matrix.indices.astype(np.int32),
+        'rating_scores': user_item_matrix.data.astype(np.float32),
+
+        #Users whose vector was re-solved after a rating write, {userId: (factors, rated positions, scores)}
+        'folded_in_users': {},
+    }
+
+def _user_ratings(model, user_id):
+
+    if user_id in model['folded_in_users']:
+        _, positions, scores = model['folded_in_users'][user_id]
+        return positions, scores
+
+    row = model['user_index'].get(user_id)
+
+    if row is None:
+        return np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+
+    start, end = model['rating_indptr'][row], model['rating_indptr'][row + 1]
+
+    return model['rating_positions'][start:end], model['rating_scores'][start:end]
+
+def _user_factors(model, user_id):
+
+    if user_id in model['folded_in_users']:
+        return model['folded_in_users'][user_id][0]
+
+    row = model['user_index'].get(user_id)
+
+    return None if row is None else model['user_factors'][row]
+
+def fold_in_rating(model, user_id, anime_id, score):
+
+    """Re-solves one user's vector against the fixed anime factors after a rating write, a single k x k system
+    The anime factors only change with the next training run, an anime nobody rated at training time is skipped
+    """
+
+    position = model['anime_index'].get(anime_id)
+
+    if position is None:
+        return
+
+    positions, scores = _user_ratings(model, user_id)
+    keep = positions != position
+
+    positions = np.append(positions[keep], position).astype(np.int32)
+    scores = np.append(scores[keep], score).astype(np.float32)
+
+    item_factors = np.asarray(model['item_factors'][positions], dtype=np.float64)
+    number_of_factors = item_factors.shape[1]
+
+    gram = item_factors.T @ item_factors + model['regularization'] * len(positions) * np.eye(number_of_factors)
+    factors = np.linalg.solve(gram, item_factors.T @ (scores - model['mean_score']))
+
+    model['folded_in_users'][user_id] = (factors.astype(np.float32), positions, scores)
+
+def recommend_factors_scored(model, user_id, number_of_recommendations, use_ann=USE_ANN):
+
+    """ Anime with the highest predicted score as (anime ids, predicted score minus the mean score) arrays, best first """
+
+    user_factors = _user_factors(model, user_id)
+
+    if user_factors is None:
+        print(f"User {user_id} has no latent factors yet")
+        return no_recommendations()
+
+    rated_positions, _ = _user_ratings(model, user_id)
+
+    #The index buckets by angle, the candidates are then ranked by the exact dot product
+    if use_ann:
+
+        top_positions, top_scores = query_lsh_index(model['ann_index'], model['item_factors'], user_factors, number_of_recommendations, rated_positions)
+
+        if len(top_positions) == number_of_recommendations:
+            return np.asarray(model['anime_ids'][top_positions], dtype=np.int64), top_scores
+
+    predicted = np.asarray(model['item_factors'] @ user_factors, dtype=np.float64)
+    predicted[rated_positions] = -np.inf
+
+    top_positions = top_n_positions(predicted, number_of_recommendations)
+
+    return scored_recommendations(model['anime_ids'], top_positions, predicted)
+
+def recommend_factors(model, user_id, number_of_recommendations, use_ann=USE_ANN):
+
+    recommended_ids, _ = recommend_factors_scored(model, user_id, number_of_recommendations, use_ann)
+
+    return [int(anime_id) for anime_id in recommended_ids]
+
+def recommend_factors_block(model, user_ids, number_of_recommendations):
+
+    """Scores a block of users with one (users x factors) @ (factors x anime) product
+    Returns one (anime ids, scores) pair per user, like recommend_factors_scored
+    """
+
+    rows = [_user_factors(model, user_id) for user_id in user_ids]
+    number_of_factors = model['item_factors'].shape[1]
+
+    user_factors = np.array([row if row is not None else np.zeros(number_of_factors, dtype=np.float32) for row in rows])
+    predicted = np.asarray(user_factors @ model['item_factors'].T, dtype=np.float64)
+
+    for row, user_id in enumerate(user_ids):
+        rated_positions, _ = _user_ratings(model, user_id)
+        predicted[row, rated_positions] = -np.inf
+
+    top_positions = top_n_positions_per_row(predicted, number_of_recommendations)
+
+    return [
+
+        scored_recommendations(model['anime_ids'], positions, row_predicted) if factors is not None else no_recommendations()
+        for positions, row_predicted, factors in zip(top_positions, predicted, rows)
+    ]
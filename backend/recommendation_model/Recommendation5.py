@@ -0,0 +1,86 @@
+""" Recommender 5: popular anime by region, the cold start path for users with no (or too few) ratings
+
+At training time the ratings are joined to their user's location (users.locationId -> locations) and every country,
+state and city with at least MIN_REGION_RATINGS ratings gets its anime ordered by number of positive ratings (score > 5),
+then by number of ratings. Serving a user is then a few dictionary lookups:
+their city's list, else their state's, else their country's, else the list over all ratings
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+#Anime kept per region, more than a page so that watched anime can be skipped
+REGIONAL_LIST_SIZE = int(os.getenv('RECOMMENDER_REGIONAL_LIST_SIZE', 100))
+
+#A region with fewer ratings than this uses the list of the region it is part of
+MIN_REGION_RATINGS = int(os.getenv('RECOMMENDER_MIN_REGION_RATINGS', 20))
+
+POSITIVE_SCORE = 5
+
+#Most specific first, a region's key is its values of these columns
+REGION_LEVELS = (('country', 'state', 'city'), ('country', 'state'), ('country',))
+
+def _region_name(value):
+
+    #Missing state / city come back as None from the database and as '' from a snapshot
+    return value if isinstance(value, str) and value != '' else None
+
+def popular_anime_ids(rated_df, list_size=REGIONAL_LIST_SIZE):
+
+    counts = rated_df.groupby('animeId').agg(positive=('positive', 'sum'), ratings=('score', 'size')).reset_index()
+    counts = counts.sort_values(['positive', 'ratings', 'animeId'], ascending=[False, False, True])
+
+    return counts['animeId'].to_numpy(dtype=np.int64)[:list_size]
+
+def build_regional_model(ratings_df, users_df, locations_df, list_size=REGIONAL_LIST_SIZE, min_region_ratings=MIN_REGION_RATINGS):
+
+    locations = locations_df[['locationId', 'country', 'state', 'city']].copy()
+
+    for column in ('country', 'state', 'city'):
+        locations[column] = locations[column].apply(_region_name)
+
+    rated = ratings_df[['userId', 'animeId', 'score']].merge(users_df[['userId', 'locationId']], on='userId', how='inner')
+    rated = rated.merge(locations, on='locationId', how='left')
+    rated['positive'] = rated['score'] > POSITIVE_SCORE
+
+    popular_by_region = {}
+
+    for columns in REGION_LEVELS:
+
+        for region, region_df in rated.dropna(subset=list(columns)).groupby(list(columns)):
+
+            if len(region_df) >= min_region_ratings:
+                popular_by_region[region if isinstance(region, tuple) else (region,)] = popular_anime_ids(region_df, list_size)
+
+    print(f"Precomputed popular anime for {len(popular_by_region)} regions with at least {min_region_ratings} ratings")
+
+    return {
+
+        'popular_by_region': popular_by_region,
+        'global_popular': popular_anime_ids(rated, list_size) if len(rated) > 0 else np.array([], dtype=np.int64),
+        'location_regions': {int(row.locationId): (row.country, row.state, row.city) for row in locations.itertuples()},
+        'user_locations': {int(user_id): int(location_id) for user_id, location_id in zip(users_df['userId'], users_df['locationId']) if not pd.isna(location_id)},
+    }
+
+def regional_popular_ids(model, location_id):
+
+    """ Popular anime ids of the most specific region of location_id that has a list, the global list otherwise """
+
+    country, state, city = model['location_regions'].get(location_id, (None, None, None))
+
+    for region in ((country, state, city), (country, state), (country,)):
+
+        if None not in region and region in model['popular_by_region']:
+            return model['popular_by_region'][region]
+
+    return model['global_popular']
+
+def recommend_regional(model, user_id, number_of_recommendations, location_id=None):
+
+    """ Popular anime in the user's region, location_id is needed for users who signed up after the model was trained """
+
+    if location_id is None:
+        location_id = model['user_locations'].get(user_id)
+
+    return [int(anime_id) for anime_id in regional_popular_ids(model, location_id)[:number_of_recommendations]]
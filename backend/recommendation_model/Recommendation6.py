@@ -0,0 +1,121 @@
+""" Recommender 6: session based next anime, from what the user is watching right now
+
+Offline, every anime gets its SESSION_NEIGHBOURS most co-watched anime: the cosine of the two anime's columns in the
+users x anime matrix of watched and watching lists, i.e. users with both / sqrt(users with one * users with the other).
+The table is kept as CSR parts, anime position p's neighbours are neighbour_positions[neighbour_indptr[p]:neighbour_indptr[p + 1]]
+
+A user's watching list is the session: the neighbours of every anime in it are summed, the anime added last weighing
+most, so a recommendation is a few array slices and one bincount, cheap enough to redo on every watching list change
+"""
+
+import os
+import numpy as np
+from .scoring import top_n_positions, no_recommendations
+from .Reccomendation2 import build_watch_matrix
+
+SESSION_NEIGHBOURS = int(os.getenv('RECOMMENDER_SESSION_NEIGHBOURS', 20))
+
+#Weight of an anime in the session is SESSION_DECAY ** (anime added after it)
+SESSION_DECAY = float(os.getenv('RECOMMENDER_SESSION_DECAY', 0.8))
+
+def build_session_model(users_df, number_of_neighbours=SESSION_NEIGHBOURS):
+
+    user_watching_animes = {
+
+        int(user_id): [int(anime_id) for anime_id in watching] for user_id, watching in zip(users_df['userId'], users_df['watchingAnime'])
+        if isinstance(watching, (list, np.ndarray))
+    }
+
+    #Both lists of a user are one co-watch transaction
+    transactions = [
+
+        list(watched) + list(watching) for watched, watching in zip(users_df['watchedAnime'], users_df['watchingAnime'])
+        if len(watched) + len(watching) > 1
+    ]
+
+    model = {
+
+        'anime_ids': np.array([], dtype=np.int64),
+        'anime_index': {},
+        'neighbour_indptr': np.zeros(1, dtype=np.int64),
+        'neighbour_positions': np.array([], dtype=np.int32),
+        'neighbour_scores': np.array([], dtype=np.float32),
+        'user_watching_animes': user_watching_animes,
+    }
+
+    if len(transactions) == 0:
+        print(f"No co-watched anime found")
+        return model
+
+    watch_matrix, anime_ids = build_watch_matrix(transactions)
+
+    co_watched = (watch_matrix.T.tocsr() @ watch_matrix).tocsr()
+    co_watched.setdiag(0)
+    co_watched.eliminate_zeros()
+
+    #Cosine of the two anime columns, the matrix is binary so the column norms are the square roots of the watch counts
+    watch_counts = np.asarray(watch_matrix.sum(axis=0)).ravel()
+    rows = np.repeat(np.arange(co_watched.shape[0]), np.diff(co_watched.indptr))
+    co_watched.data = co_watched.data / np.sqrt(watch_counts[rows] * watch_counts[co_watched.indices])
+
+    neighbour_positions, neighbour_scores, neighbour_counts = [], [], []
+
+    for position in range(co_watched.shape[0]):
+
+        start, end = co_watched.indptr[position], co_watched.indptr[position + 1]
+        best = top_n_positions(co_watched.data[start:end], number_of_neighbours)
+
+        neighbour_positions.append(co_watched.indices[start:end][best])
+        neighbour_scores.append(co_watched.data[start:end][best])
+        neighbour_counts.append(len(best))
+
+    print(f"Co-watch neighbours of {len(anime_ids)} anime from {len(transactions)} watch lists")
+
+    model.update({
+
+        'anime_ids': anime_ids,
+        'anime_index': {int(anime_id): position for position, anime_id in enumerate(anime_ids)},
+        'neighbour_indptr': np.concatenate([[0], np.cumsum(neighbour_counts)]).astype(np.int64),
+        'neighbour_positions': np.concatenate(neighbour_positions).astype(np.int32),
+        'neighbour_scores': np.concatenate(neighbour_scores).astype(np.float32),
+    })
+
+    return model
+
+def recommend_next_scored(model, watching, number_of_recommendations, excluded_ids=()):
+
+    """ Next anime for a watching list as (anime ids, summed neighbour scores) arrays, best first, without the list itself and excluded_ids """
+
+    positions = np.array([model['anime_index'][anime_id] for anime_id in watching if anime_id in model['anime_index']], dtype=np.int64)
+
+    if len(positions) == 0:
+        return no_recommendations()
+
+    #Position in the list counted from its end, the anime added last has weight 1
+    weights = SESSION_DECAY ** np.arange(len(positions) - 1, -1, -1, dtype=np.float64)
+
+    starts, ends = model['neighbour_indptr'][positions], model['neighbour_indptr'][positions + 1]
+    slots = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+
+    if len(slots) == 0:
+        return no_recommendations()
+
+    candidates, inverse = np.unique(model['neighbour_positions'][slots], return_inverse=True)
+    totals = np.bincount(inverse, weights=model['neighbour_scores'][slots] * np.repeat(weights, ends - starts), minlength=len(candidates))
+
+    excluded_positions = np.concatenate([positions, [model['anime_index'][anime_id] for anime_id in excluded_ids if anime_id in model['anime_index']]])
+    totals[np.isin(candidates, excluded_positions)] = -np.inf
+
+    top = top_n_positions(totals, number_of_recommendations)
+
+    return np.asarray(model['anime_ids'][candidates[top]], dtype=np.int64), np.asarray(totals[top], dtype=np.float64)
+
+def recommend_session_scored(model, user_id, number_of_recommendations):
+
+    return recommend_next_scored(model, model['user_watching_animes'].get(user_id, []), number_of_recommendations)
+
+def recommend_next(model, watching, number_of_recommendations, excluded_ids=()):
+
+    recommended_ids, _ = recommend_next_scored(model, watching, number_of_recommendations, excluded_ids)
+
+    return [int(anime_id) for anime_id in recommended_ids]
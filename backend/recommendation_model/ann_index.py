@@ -0,0 +1,95 @@
+""" Approximate nearest neighbour index over anime vectors, using random projection LSH
+
+Every table hashes a vector to number_of_bits bits, bit i telling on which side of random hyperplane i it lies, so
+vectors with a small angle between them mostly land in the same bucket. A query only scores the anime sharing a bucket
+with it in at least one table (or, with probing, a bucket one bit away) exactly, instead of the whole catalog
+
+Buckets are kept as the anime positions sorted by their code in every table, so a lookup is one binary search per probe
+and the index is a handful of numpy arrays that are saved and memory-mapped with the rest of the artifact
+
+Set RECOMMENDER_ANN=1 to serve the content based and matrix factorization recommenders through their index,
+python -m recommendation_model.bench_ann measures recall and latency against the exact path for a few index shapes
+"""
+
+import os
+import numpy as np
+from .scoring import top_n_positions
+
+USE_ANN = os.getenv('RECOMMENDER_ANN', '0') == '1'
+ANN_TABLES = int(os.getenv('RECOMMENDER_ANN_TABLES', 8))
+ANN_BITS = int(os.getenv('RECOMMENDER_ANN_BITS', 8))
+
+#Also visit the buckets one bit flip away: several times the recall for several times the candidates to score
+ANN_PROBE = os.getenv('RECOMMENDER_ANN_PROBE', '1') == '1'
+
+def _codes(index, vectors):
+
+    """ Bucket code of every vector (rows of a dense or sparse matrix) in every table, shape (vectors, tables) """
+
+    number_of_tables, number_of_bits = index['number_of_tables'], index['number_of_bits']
+
+    above = np.asarray(vectors @ index['planes'].T) > 0
+    above = above.reshape(above.shape[0], number_of_tables, number_of_bits)
+
+    return (above * (np.int64(1) << np.arange(number_of_bits, dtype=np.int64))).sum(axis=2)
+
+def build_lsh_index(vectors, number_of_tables=ANN_TABLES, number_of_bits=ANN_BITS, seed=0):
+
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((number_of_tables * number_of_bits, vectors.shape[1])).astype(np.float32)
+
+    index = {'number_of_tables': number_of_tables, 'number_of_bits': number_of_bits, 'planes': planes}
+
+    codes = _codes(index, vectors)
+    order = np.argsort(codes, axis=0, kind='stable')
+
+    #Per table: anime positions sorted by code, and the codes in that order for the binary search
+    index['order'] = np.ascontiguousarray(order.T).astype(np.int32)
+    index['sorted_codes'] = np.ascontiguousarray(np.take_along_axis(codes, order, axis=0).T)
+
+    return index
+
+def lsh_candidates(index, query, probe=ANN_PROBE):
+
+    """ Positions of the anime sharing a bucket with query in any table, probe also visits the buckets one bit flip away """
+
+    code = _codes(index, query.reshape(1, -1))[0]
+
+    flips = np.int64(1) << np.arange(index['number_of_bits'], dtype=np.int64)
+    masks = np.concatenate([[0], flips]) if probe else np.array([0], dtype=np.int64)
+
+    candidates = []
+
+    for table in range(index['number_of_tables']):
+
+        probes = code[table] ^ masks
+        sorted_codes = index['sorted_codes'][table]
+
+        starts = np.searchsorted(sorted_codes, probes, side='left')
+        ends = np.searchsorted(sorted_codes, probes, side='right')
+
+        candidates += [index['order'][table][start:end] for start, end in zip(starts, ends) if end > start]
+
+    if len(candidates) == 0:
+        return np.array([], dtype=np.int64)
+
+    return np.unique(np.concatenate(candidates)).astype(np.int64)
+
+def query_lsh_index(index, vectors, query, number_of_results, excluded_positions=None, probe=ANN_PROBE):
+
+    """Best number_of_results positions by dot(vectors[position], query) among the LSH candidates and their dot products, best first
+    Candidates are scored exactly, only anime outside every probed bucket can be missed
+    """
+
+    candidates = lsh_candidates(index, query, probe)
+
+    if excluded_positions is not None and len(excluded_positions) > 0:
+        candidates = candidates[~np.isin(candidates, excluded_positions)]
+
+    if len(candidates) == 0:
+        return candidates, np.array([], dtype=np.float64)
+
+    scores = np.asarray(vectors[candidates] @ query, dtype=np.float64).ravel()
+    top = top_n_positions(scores, number_of_results)
+
+    return candidates[top], scores[top]
@@ -0,0 +1,108 @@
+""" Batch recommendation mode: loads the data once, scores users block by block and writes the results to precomputed_recommendations
+
+Run from the backend directory with:
+    python -m recommendation_model.batch                 (every user)
+    python -m recommendation_model.batch --users 12 42   (only these users)
+"""
+
+import argparse, time
+from datetime import datetime
+from sqlalchemy import text
+
+from .engine import get_sync_engine
+from .load_data import load_training_data
+from .main_ml_model import build_recommendation_models
+from .model_artifact import save_artifact, journal_position
+from .Recommendation1 import neighbour_matrix, recommend_collaborative_block
+from .Reccomendation2 import recommend_association_scored
+from .Recommendation3 import recommend_content_based_block
+from .Recommendation4 import recommend_factors_block
+from .Recommendation5 import recommend_regional
+from .Recommendation6 import recommend_session_scored
+from .ranking import rank_recommendations, complete_recommendations
+
+UPSERT_PRECOMPUTED_RECOMMENDATIONS = text(
+
+    'INSERT INTO precomputed_recommendations ("userId", "recommendations", "model_version", "generated_at") '
+    'VALUES (:userId, :recommendations, :model_version, :generated_at) '
+    'ON CONFLICT ("userId") DO UPDATE SET "recommendations" = EXCLUDED."recommendations", '
+    '"model_version" = EXCLUDED."model_version", "generated_at" = EXCLUDED."generated_at"'
+)
+
+def score_user_block(models, user_ids, number_of_recommendations, neighbours, number_of_candidates=None):
+
+    number_of_candidates = number_of_candidates or number_of_recommendations
+
+    collaborative = recommend_collaborative_block(models['collaborative'], user_ids, number_of_candidates, neighbours)
+    content_based = recommend_content_based_block(models['content_based'], user_ids, number_of_candidates)
+    matrix_factorization = recommend_factors_block(models['matrix_factorization'], user_ids, number_of_candidates)
+
+    block_recommendations = []
+
+    for user_id, recom1, recom3, recom4 in zip(user_ids, collaborative, content_based, matrix_factorization):
+
+        recom2 = recommend_association_scored(models['association'], user_id, number_of_candidates)
+        recom5 = recommend_session_scored(models['session'], user_id, number_of_candidates)
+
+        #Same ranking stage as the endpoint, without the anime the user watched or is watching
+        scored_lists = {'collaborative': recom1, 'association': recom2, 'content_based': recom3, 'matrix_factorization': recom4, 'session': recom5}
+        excluded_ids = models['association']['user_watched_animes'].get(user_id, []) + models['session']['user_watching_animes'].get(user_id, [])
+        ranked_ids, ranked_scores = rank_recommendations(scored_lists, number_of_recommendations, excluded_ids)
+
+        #Users with too few ratings are completed with their region's popular anime, as the endpoint does
+        if len(ranked_ids) < number_of_recommendations:
+            popular_ids = recommend_regional(models['regional_popularity'], user_id, number_of_recommendations + len(excluded_ids))
+            ranked_ids, _ = complete_recommendations(ranked_ids, ranked_scores, popular_ids, number_of_recommendations, excluded_ids)
+
+        block_recommendations.append(ranked_ids.tolist())
+
+    return block_recommendations
+
+def run_batch(user_ids=None, number_of_recommendations=20, block_size=512, number_of_candidates=20):
+
+    start_time = time.perf_counter()
+
+    #Same as train_recommendation_models, changes published while training are carried over into the new artifact
+    journal_since = journal_position()
+    training_data = load_training_data()
+
+    models = build_recommendation_models(training_data)
+    model_version = save_artifact(models, journal_since=journal_since)
+
+    if user_ids is None:
+        user_ids = [int(user_id) for user_id in training_data['users']['userId']]
+
+    #The neighbour matrix is shared by every block
+    neighbours = neighbour_matrix(models['collaborative'])
+    generated_at = datetime.now()
+
+    for block_start in range(0, len(user_ids), block_size):
+
+        block_user_ids = user_ids[block_start:block_start + block_size]
+        block_recommendations = score_user_block(models, block_user_ids, number_of_recommendations, neighbours, number_of_candidates)
+
+        rows = [
+
+            {'userId': user_id, 'recommendations': recommendations, 'model_version': model_version, 'generated_at': generated_at}
+            for user_id, recommendations in zip(block_user_ids, block_recommendations)
+        ]
+
+        with get_sync_engine().begin() as connection:
+            connection.execute(UPSERT_PRECOMPUTED_RECOMMENDATIONS, rows)
+
+        print(f"Scored users {block_start + 1} to {block_start + len(block_user_ids)} of {len(user_ids)}")
+
+    print(f"Precomputed recommendations for {len(user_ids)} users with model {model_version} in {time.perf_counter() - start_time:.1f}s")
+
+    return model_version
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Precompute recommendations for many users at once")
+    parser.add_argument('--users', type=int, nargs='+', help="User ids to score, every user when left out")
+    parser.add_argument('--number', type=int, default=20, help="Ranked recommendations kept per user")
+    parser.add_argument('--candidates', type=int, default=20, help="Candidates every recommender contributes to the ranking")
+    parser.add_argument('--block-size', type=int, default=512, help="Users scored per matrix product")
+    args = parser.parse_args()
+
+    run_batch(args.users, args.number, args.block_size, args.candidates)
@@ -0,0 +1,80 @@
+""" Recall / latency benchmark of the LSH index against exact scoring
+
+For a sample of users it takes the exact top N of the content based and matrix factorization recommenders, then
+rebuilds the LSH index of each with every (tables, bits) shape given and reports recall@N of the approximate top N
+and the mean query time of both paths, so RECOMMENDER_ANN_TABLES / RECOMMENDER_ANN_BITS can be picked from the numbers
+Bucket probing follows RECOMMENDER_ANN_PROBE, run it once with each value to compare
+
+Run from the backend directory with:  python -m recommendation_model.bench_ann
+(it uses the latest trained artifact, training one if there is none)
+"""
+
+import argparse, time
+import numpy as np
+
+from .main_ml_model import get_trained_models
+from .ann_index import build_lsh_index
+from .Recommendation3 import recommend_content_based
+from .Recommendation4 import recommend_factors
+
+#(model name, recommender, vectors the index is built over)
+BENCHMARKED_RECOMMENDERS = (
+
+    ('content_based', recommend_content_based, 'genre_matrix'),
+    ('matrix_factorization', recommend_factors, 'item_factors'),
+)
+
+def timed_recommendations(recommender, model, user_ids, number_of_recommendations, use_ann):
+
+    recommendations, elapsed = [], 0.0
+
+    for user_id in user_ids:
+        start = time.perf_counter()
+        recommendations.append(recommender(model, user_id, number_of_recommendations, use_ann=use_ann))
+        elapsed += time.perf_counter() - start
+
+    return recommendations, elapsed / max(len(user_ids), 1) * 1000
+
+def recall(approximate, exact):
+
+    found = sum(len(set(approximate_ids) & set(exact_ids)) for approximate_ids, exact_ids in zip(approximate, exact))
+    expected = sum(len(exact_ids) for exact_ids in exact)
+
+    return found / expected if expected > 0 else 1.0
+
+def run_benchmark(shapes, number_of_users=200, number_of_recommendations=10, seed=0):
+
+    models = get_trained_models()
+
+    for model_name, recommender, vectors_key in BENCHMARKED_RECOMMENDERS:
+
+        #The copy gets the rebuilt indexes, the served models stay as loaded
+        model = dict(models[model_name])
+        all_user_ids = list(model['user_index']) if 'user_index' in model else list(model['user_liked_animes'])
+
+        rng = np.random.default_rng(seed)
+        user_ids = [int(user_id) for user_id in rng.permutation(all_user_ids)[:number_of_users]]
+
+        exact, exact_ms = timed_recommendations(recommender, model, user_ids, number_of_recommendations, use_ann=False)
+
+        print(f"\n{model_name}: {model[vectors_key].shape[0]} anime, {len(user_ids)} users, top {number_of_recommendations}")
+        print(f"  exact                     {exact_ms:8.3f} ms/query  recall 1.000")
+
+        for number_of_tables, number_of_bits in shapes:
+
+            model['ann_index'] = build_lsh_index(model[vectors_key], number_of_tables, number_of_bits, seed)
+            approximate, approximate_ms = timed_recommendations(recommender, model, user_ids, number_of_recommendations, use_ann=True)
+
+            print(f"  lsh tables={number_of_tables:<3d} bits={number_of_bits:<3d}  {approximate_ms:8.3f} ms/query  recall {recall(approximate, exact):.3f}")
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Recall and latency of the LSH index against exact scoring")
+    parser.add_argument('--users', type=int, default=200, help="Users sampled as queries")
+    parser.add_argument('--number', type=int, default=10, help="Recommendations per query (the N of recall@N)")
+    parser.add_argument('--shapes', nargs='+', default=['4x8', '8x8', '8x12', '16x12'], help="Index shapes as TABLESxBITS")
+    args = parser.parse_args()
+
+    shapes = [tuple(int(part) for part in shape.split('x')) for shape in args.shapes]
+
+    run_benchmark(shapes, args.users, args.number)
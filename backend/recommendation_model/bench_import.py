@@ -0,0 +1,106 @@
+""" Import time benchmark of the recommender serving path
+
+Imports recommendation_model.executor (what core.main imports at FastAPI startup) in fresh interpreters and fails
+when the import is slower than the budget or when it loads Django or one of the heavy ML libraries, which must only be
+imported once a model is trained or served
+
+Run from the backend directory with:  python -m recommendation_model.bench_import
+Exits with status 1 on a regression, so it can gate CI
+"""
+
+import os, sys, json, time, argparse, statistics, subprocess
+
+IMPORT_TARGET = 'recommendation_model.executor'
+
+#Modules that must not be loaded by importing IMPORT_TARGET
+FORBIDDEN_MODULES = ('django', 'pandas', 'numpy', 'scipy', 'sklearn', 'mlxtend', 'joblib', 'matplotlib')
+
+#Median import time allowed, in milliseconds
+IMPORT_BUDGET_MS = float(os.getenv('RECOMMENDER_IMPORT_BUDGET_MS', 50))
+
+#Already loaded by uvicorn / FastAPI before core.main is imported, so they are imported before the timer starts
+BASELINE_IMPORTS = ('asyncio', 'concurrent.futures')
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = f"""
+import sys, json, time
+import {', '.join(BASELINE_IMPORTS)}
+start = time.perf_counter()
+import {IMPORT_TARGET}
+elapsed_ms = (time.perf_counter() - start) * 1000
+loaded = sorted(name for name in {FORBIDDEN_MODULES!r} if name in sys.modules)
+print(json.dumps({{'elapsed_ms': elapsed_ms, 'loaded': loaded}}))
+"""
+
+def slowest_imports(importtime_log, number_of_modules=10):
+
+    """ Parses python -X importtime output into the modules with the largest cumulative import time, in microseconds """
+
+    timings = []
+
+    for line in importtime_log.splitlines():
+
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, module = line[len('import time:'):].split('|')
+        timings.append((int(cumulative), module.strip()))
+
+    return sorted(timings, reverse=True)[:number_of_modules]
+
+def measure_import():
+
+    """ One import of IMPORT_TARGET in a new interpreter, nothing is cached by an earlier run """
+
+    completed = subprocess.run(
+
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['slowest'] = slowest_imports(completed.stderr)
+
+    return result
+
+def run_benchmark(runs=5, budget_ms=IMPORT_BUDGET_MS) -> bool:
+
+    results = [measure_import() for _ in range(runs)]
+
+    median_ms = statistics.median(result['elapsed_ms'] for result in results)
+    loaded = sorted({name for result in results for name in result['loaded']})
+
+    print(f"import {IMPORT_TARGET}: median {median_ms:.1f} ms over {runs} runs (budget {budget_ms:.0f} ms)")
+
+    passed = True
+
+    if loaded:
+        print(f"FAIL: importing {IMPORT_TARGET} loads {', '.join(loaded)}")
+        passed = False
+
+    if median_ms > budget_ms:
+        print(f"FAIL: import time is over budget")
+        passed = False
+
+    if not passed:
+
+        print(f"Slowest imports (cumulative):")
+
+        for cumulative_us, module in results[-1]['slowest']:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    return passed
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=f"Benchmark the import time of {IMPORT_TARGET}")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters to time")
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS, help="Median import time allowed")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    passed = run_benchmark(arguments.runs, arguments.budget_ms)
+    print(f"Benchmark finished in {time.perf_counter() - start:.1f}s")
+
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,126 @@
+""" Delta loading of the training data
+
+A snapshot remembers the newest rating change it holds (its watermark) and a 64 bit fingerprint of every user's watch
+lists. Refreshing it only transfers the ratings created or edited since the watermark, the (userId, fingerprint) pairs
+and the full rows of the users whose fingerprint changed, instead of re-reading every table
+
+updated_at is set when the API flushes a rating, not when its transaction commits, so a rating can become visible with
+an updated_at already behind the watermark. The delta therefore starts WATERMARK_LAG before the watermark, the ratings
+read twice are replaced by ratingId. Ratings deleted in the Django admin are found by diffing the ratingIds, one integer
+column instead of the whole table. The anime and locations tables are small and have no updated_at column, so they are
+always reloaded in full
+
+Run from the backend directory with:  python -m recommendation_model.snapshot --delta
+"""
+
+import os
+import pandas as pd
+
+from .load_data import ALL_RECOMMENDERS, DELTA_COLUMNS, projected_columns, read_table, load_ratings_since, load_rating_ids, load_watch_list_hashes, load_users
+
+#Longest a rating write can take from its flush to its commit
+WATERMARK_LAG = pd.Timedelta(seconds=int(os.getenv('RECOMMENDER_WATERMARK_LAG_SECONDS', 600)))
+
+def merge_rating_delta(ratings_df, changed_ratings_df, current_rating_ids=None):
+
+    """ Replaces the ratings whose ratingId is in the delta, appends the new ones and drops the ones not in current_rating_ids """
+
+    if current_rating_ids is not None:
+        ratings_df = ratings_df[ratings_df['ratingId'].isin(current_rating_ids)]
+
+    if len(changed_ratings_df) == 0:
+        return ratings_df.reset_index(drop=True)
+
+    unchanged = ratings_df[~ratings_df['ratingId'].isin(changed_ratings_df['ratingId'])]
+
+    return pd.concat([unchanged, changed_ratings_df[ratings_df.columns]], ignore_index=True)
+
+def changed_user_ids(users_df, current_hashes_df):
+
+    """ Users that are new or whose watch list fingerprint differs, and users that no longer exist """
+
+    known = users_df[['userId', 'watchHash']].merge(current_hashes_df, on='userId', how='outer', suffixes=('_known', ''), indicator=True)
+
+    changed = known[(known['_merge'] == 'right_only') | ((known['_merge'] == 'both') & (known['watchHash_known'] != known['watchHash']))]
+    removed = known[known['_merge'] == 'left_only']
+
+    return changed['userId'].to_numpy(), removed['userId'].to_numpy()
+
+def merge_user_delta(users_df, changed_users_df, removed_user_ids):
+
+    """ Swaps in the reloaded rows of the changed users and drops the removed ones """
+
+    if len(changed_users_df) == 0 and len(removed_user_ids) == 0:
+        return users_df
+
+    replaced = users_df['userId'].isin(changed_users_df['userId']) | users_df['userId'].isin(removed_user_ids)
+
+    return pd.concat([users_df[~replaced], changed_users_df[users_df.columns]], ignore_index=True)
+
+def apply_delta(training_data: dict, watermark):
+
+    """Brings a dataset loaded with its delta columns (load_training_data(with_delta_columns=True) or a snapshot
+    opened with all_columns) up to date with the database. Works the same for an in-memory dataset and a snapshot
+    Returns the merged dataset and its new watermark
+    """
+
+    merged = dict(training_data)
+
+    if 'ratings' in training_data:
+
+        ratings_df = training_data['ratings']
+
+        if watermark is None:
+            changed_ratings, current_rating_ids = read_table('ratings', list(ratings_df.columns)), None
+        else:
+            changed_ratings = load_ratings_since(pd.Timestamp(watermark) - WATERMARK_LAG, list(ratings_df.columns))
+            current_rating_ids = load_rating_ids()['ratingId']
+
+        merged['ratings'] = merge_rating_delta(ratings_df, changed_ratings, current_rating_ids)
+        deleted = 0 if current_rating_ids is None else int((~ratings_df['ratingId'].isin(current_rating_ids)).sum())
+        print(f"Rating delta: {len(changed_ratings)} new or edited ratings since {watermark} (minus {WATERMARK_LAG}), {deleted} deleted")
+
+        if len(merged['ratings']) > 0:
+            watermark = pd.Timestamp(merged['ratings']['updated_at'].max()).isoformat()
+
+    if 'users' in training_data:
+
+        users_df = training_data['users']
+        changed, removed = changed_user_ids(users_df, load_watch_list_hashes())
+
+        merged['users'] = merge_user_delta(users_df, load_users(changed, list(users_df.columns)), removed)
+        print(f"User delta: {len(changed)} watch lists changed, {len(removed)} users removed")
+
+    for table in ('anime', 'locations'):
+        if table in training_data:
+            merged[table] = read_table(table, list(training_data[table].columns))
+
+    return merged, watermark
+
+def refresh_snapshot(snapshot_version: str = None) -> str:
+
+    """ Writes a new snapshot from the latest one plus the delta, falls back to a full load when there is no usable snapshot """
+
+    from .snapshot import latest_snapshot_version, read_snapshot_manifest, open_snapshot, write_snapshot
+
+    base_version = snapshot_version or latest_snapshot_version()
+
+    if base_version is None:
+        print(f"No snapshot to refresh, writing a full one")
+        return write_snapshot()
+
+    manifest = read_snapshot_manifest(base_version)
+    base_data = open_snapshot(snapshot_version=base_version, all_columns=True)
+
+    #Snapshots written before delta columns (or a recommender's columns) existed cannot be diffed against the database
+    missing_tables = set(projected_columns(ALL_RECOMMENDERS)) - set(base_data)
+    missing_delta_columns = [(table, column) for table, columns in DELTA_COLUMNS.items() if table in base_data for column in columns if column not in base_data[table]]
+    missing_columns = [(table, column) for table, columns in projected_columns(ALL_RECOMMENDERS).items() if table in base_data for column in columns if column not in base_data[table]]
+
+    if missing_tables or missing_delta_columns or missing_columns:
+        print(f"Snapshot {base_version} lacks columns the recommenders need, writing a full one")
+        return write_snapshot()
+
+    merged, _ = apply_delta(base_data, manifest.get('watermark'))
+
+    return write_snapshot(merged)
@@ -1,15 +1,21 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 
 load_dotenv()
 
 DATABASE_URL_FOR_SYNC_ENGINE = os.getenv('SYNC_DATABASE_URL')
 
-if not DATABASE_URL_FOR_SYNC_ENGINE:
-    raise ValueError(f"Sync database url is not set")
+@lru_cache(maxsize=None)
+def get_sync_engine():
 
-sync_engine = create_engine(
+    #Created on first use, so importing the recommender package never connects to or configures the database
+    from sqlalchemy import create_engine
 
-    DATABASE_URL_FOR_SYNC_ENGINE, echo=True
-)
\ No newline at end of file
+    if not DATABASE_URL_FOR_SYNC_ENGINE:
+        raise ValueError(f"Sync database url is not set")
+
+    return create_engine(
+
+        DATABASE_URL_FOR_SYNC_ENGINE, echo=True
+    )
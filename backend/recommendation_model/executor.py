@@ -0,0 +1,179 @@
+""" Process pool that scores recommendations off the API's event loop
+
+Scoring is CPU bound numpy / scipy work, so running it inside an async endpoint stalls every other request of that
+uvicorn worker. The API awaits these functions instead, they run in a pool of worker processes that each load the
+trained models once, when the process starts, and then keep them in memory
+
+RECOMMENDER_WORKERS sets the pool size. 0 runs scoring in a thread of the API process instead (no extra processes,
+the event loop is still free but scoring shares the GIL with the API)
+
+The recommenders of one request run as separate pool tasks at the same time, each with its own deadline
+(RECOMMENDER_DEADLINE_MS, or RECOMMENDER_<NAME>_DEADLINE_MS for one of them). A recommender that misses its deadline
+contributes nothing and is reported as timed out (so does one that raises), so a request waits at most for the longest deadline.
+What came back in time is blended into one ordered list by the ranking stage (ranking.py), and a list that comes out
+short (a new user, nothing rated yet) is filled up with the popular anime of the user's region (Recommendation5.py)
+"""
+
+import os, time, asyncio, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from . import main_ml_model
+from .main_ml_model import RECOMMENDER_NAMES, latest_model_version, train_recommendation_models, get_trained_models, serve_recommender, serve_regional_popularity, serve_next_anime, get_similar_anime
+
+#One per recommender by default, so the recommenders of a request never wait for each other
+RECOMMENDER_WORKERS = int(os.getenv('RECOMMENDER_WORKERS', len(RECOMMENDER_NAMES)))
+
+#How long each recommender may take before the request goes on without it, configured in ms and kept in seconds
+DEFAULT_DEADLINE_MS = float(os.getenv('RECOMMENDER_DEADLINE_MS', 500))
+RECOMMENDER_DEADLINES = {
+
+    recommender: float(os.getenv(f'RECOMMENDER_{recommender.upper()}_DEADLINE_MS', DEFAULT_DEADLINE_MS)) / 1000
+    for recommender in RECOMMENDER_NAMES
+}
+
+#Candidates every recommender contributes to the ranking stage, and the length of the final ranked list
+RECOMMENDER_CANDIDATES = int(os.getenv('RECOMMENDER_CANDIDATES', 20))
+NUMBER_OF_RECOMMENDATIONS = int(os.getenv('RECOMMENDATIONS_SHOWN', 20))
+
+#Pool shared by all requests of this API process, created by start_recommender_pool at startup
+_pool = {'executor': None}
+
+def _warm_worker():
+
+    """ Runs once in every new worker process: imports the recommenders and loads the models before the first request """
+
+    from . import Recommendation1, Reccomendation2, Recommendation3, Recommendation4, Recommendation5, Recommendation6
+
+    #Training is left to start_recommender_pool (or train_model), a worker only loads what is there
+    main_ml_model.TRAIN_IF_MISSING = False
+
+    try:
+        get_trained_models()
+
+    #A worker without models still starts, it loads them on its first request once an artifact exists
+    except Exception as e:
+        print(f"Recommender worker {os.getpid()} could not preload the models: {e}")
+
+def _worker_ready():
+
+    #Holds the worker for a moment so that each startup task lands on a different process
+    time.sleep(0.2)
+    return os.getpid()
+
+async def start_recommender_pool(workers: int = RECOMMENDER_WORKERS):
+
+    if _pool['executor'] is not None:
+        return
+
+    #Trained once here when there is no artifact yet, the workers (or the scoring threads) then all load the same one
+    if latest_model_version() is None:
+
+        print(f"No trained recommendation model found, training one before starting the recommender pool")
+
+        try:
+            await asyncio.to_thread(train_recommendation_models)
+
+        #The API still starts, recommendations fail until python -m recommendation_model.train_model has run
+        except Exception as e:
+            print(f"Training the recommendation models failed: {e}. Run python -m recommendation_model.train_model")
+
+    if workers <= 0:
+        return
+
+    #spawn, not fork: forking a process that already runs an event loop and database connections is unsafe
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_warm_worker)
+    _pool['executor'] = executor
+
+    #One task per worker at once makes the pool start all of them now, each waits for its initializer to finish
+    loop = asyncio.get_running_loop()
+    worker_pids = await asyncio.gather(*[loop.run_in_executor(executor, _worker_ready) for _ in range(workers)])
+
+    print(f"Recommender pool ready with {len(set(worker_pids))} warm workers")
+
+async def stop_recommender_pool():
+
+    executor, _pool['executor'] = _pool['executor'], None
+
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+async def run_recommender(function, *args):
+
+    """ Awaits function(*args) in the pool, or in a thread when the pool is disabled """
+
+    return await asyncio.get_running_loop().run_in_executor(_pool['executor'], function, *args)
+
+async def run_with_deadline(recommender: str, user_id: int, number_of_recommendations: int):
+
+    try:
+        return await asyncio.wait_for(run_recommender(serve_recommender, recommender, user_id, number_of_recommendations), RECOMMENDER_DEADLINES[recommender])
+
+    #A pool task that already started cannot be stopped, it finishes in the background and its result is dropped
+    except asyncio.TimeoutError:
+        print(f"Recommender {recommender} missed its {RECOMMENDER_DEADLINES[recommender] * 1000:.0f} ms deadline for user {user_id}")
+        return None
+
+    #A recommender that fails counts like one that timed out, the others' results are still served
+    except Exception as e:
+        print(f"Recommender {recommender} failed for user {user_id}: {e!r}")
+        return None
+
+async def popular_in_region(user_id: int, location_id, number_of_recommendations: int):
+
+    try:
+        return await asyncio.wait_for(run_recommender(serve_regional_popularity, user_id, location_id, number_of_recommendations), DEFAULT_DEADLINE_MS / 1000)
+
+    except asyncio.TimeoutError:
+        print(f"Regional popularity missed its {DEFAULT_DEADLINE_MS:.0f} ms deadline for user {user_id}")
+        return None
+
+    except Exception as e:
+        print(f"Regional popularity failed for user {user_id}: {e!r}")
+        return None
+
+async def recommend_for_user(user_id: int, excluded_ids=(), number_of_recommendations: int = NUMBER_OF_RECOMMENDATIONS, location_id: int = None):
+
+    """Runs the recommenders concurrently and blends what they returned in time into one ranked list
+    Returns the ranked anime ids, their blended scores and the recommenders that timed out or failed
+    location_id picks the regional popular anime a short list is completed with, for users newer than the model
+    """
+
+    #numpy is only needed here, once the first recommendation is asked for
+    from .ranking import rank_recommendations, complete_recommendations
+
+    results = await asyncio.gather(*[run_with_deadline(recommender, user_id, RECOMMENDER_CANDIDATES) for recommender in RECOMMENDER_NAMES])
+
+    scored_lists = {recommender: result for recommender, result in zip(RECOMMENDER_NAMES, results) if result is not None}
+    timed_out = [recommender for recommender, result in zip(RECOMMENDER_NAMES, results) if result is None]
+
+    ranked_ids, ranked_scores = rank_recommendations(scored_lists, number_of_recommendations, excluded_ids)
+
+    #Cold start: lookup of a list precomputed per region, enough of it that excluded anime can be skipped
+    if len(ranked_ids) < number_of_recommendations:
+
+        popular_ids = await popular_in_region(user_id, location_id, number_of_recommendations + len(excluded_ids))
+
+        if popular_ids is None:
+            timed_out.append('regional_popularity')
+        else:
+            ranked_ids, ranked_scores = complete_recommendations(ranked_ids, ranked_scores, popular_ids, number_of_recommendations, excluded_ids)
+
+    return ranked_ids.tolist(), ranked_scores.tolist(), timed_out
+
+async def recommend_next_anime(user_id: int, watching: list, excluded_ids=(), number_of_recommendations: int = RECOMMENDER_CANDIDATES):
+
+    """ Session recommendations for a watching list that just changed, None if they missed the session recommender's deadline """
+
+    try:
+        return await asyncio.wait_for(run_recommender(serve_next_anime, list(watching), list(excluded_ids), number_of_recommendations), RECOMMENDER_DEADLINES['session'])
+
+    except asyncio.TimeoutError:
+        print(f"Session recommendations missed their {RECOMMENDER_DEADLINES['session'] * 1000:.0f} ms deadline for user {user_id}")
+        return None
+
+    except Exception as e:
+        print(f"Session recommendations failed for user {user_id}: {e!r}")
+        return None
+
+async def find_similar_anime(anime_id: int, number_of_results: int = 10):
+    return await run_recommender(get_similar_anime, anime_id, number_of_results)
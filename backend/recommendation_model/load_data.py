@@ -1,30 +1,139 @@
-import django
 import pandas as pd
 import os
 import numpy as np
-import sys 
-from .engine import sync_engine
+import ast
+from sqlalchemy import text
+from .engine import get_sync_engine
 
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-sys.path.append(PROJECT_ROOT)
+""" Column projected loading for the recommenders: only the columns a recommender reads are selected, with compact dtypes """
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
-django.setup()
+ALL_RECOMMENDERS = ('collaborative', 'association', 'content_based', 'matrix_factorization', 'regional_popularity', 'session')
+
+#Columns of every table that each recommender needs, tables not listed for the requested recommenders are never queried
+RECOMMENDER_COLUMNS = {
+
+    'collaborative': {'ratings': ['userId', 'animeId', 'score']},
+    'association': {'users': ['userId', 'watchedAnime']},
+    'content_based': {'ratings': ['userId', 'animeId', 'score'], 'anime': ['animeId', 'genres']},
+    'matrix_factorization': {'ratings': ['userId', 'animeId', 'score']},
+    'regional_popularity': {'ratings': ['userId', 'animeId', 'score'], 'users': ['userId', 'locationId'], 'locations': ['locationId', 'country', 'state', 'city']},
+    'session': {'users': ['userId', 'watchedAnime', 'watchingAnime']},
+}
+
+#dtypes assigned at read time, ids fit int32 (generate_uuid keeps them below 2^31) and scores are 1 to 10
+COLUMN_DTYPES = {
+
+    'userId': 'int32',
+    'animeId': 'int32',
+    'locationId': 'int32',
+    'genreId': 'int32',
+    'score': 'int8',
+    'studio': 'category',
+    'ratingId': 'int32',
+    'watchHash': 'int64',
+}
+
+#Postgres integer array columns, which come back as lists (or as their text form from some drivers)
+ID_LIST_COLUMNS = ('genres', 'watchedAnime', 'watchingAnime')
+
+def as_id_list(value):
+
+    if isinstance(value, str):
+        value = ast.literal_eval(value.replace('{', '[').replace('}', ']'))
+
+    return [int(item) for item in value] if isinstance(value, (list, tuple)) else []
+
+def projected_columns(recommenders=ALL_RECOMMENDERS):
+
+    tables = {}
+
+    for recommender in recommenders:
+        for table, columns in RECOMMENDER_COLUMNS[recommender].items():
+            tables.setdefault(table, [])
+            tables[table] += [column for column in columns if column not in tables[table]]
+
+    return tables
+
+#Where training reads from: 'database' (Postgres) or 'snapshot' (the memory-mapped columnar snapshot)
+TRAINING_DATA_SOURCE = os.getenv('RECOMMENDER_DATA_SOURCE', 'database')
+
+#Columns that are computed in SQL instead of read as is
+COLUMN_EXPRESSIONS = {
+
+    #updated_at is only filled on edits, so an untouched rating counts from its creation
+    ('ratings', 'updated_at'): 'COALESCE("updated_at", "created_at")',
+
+    #64 bit fingerprint of both watch lists, lets a delta refresh find the users whose lists changed without reading the lists
+    ('users', 'watchHash'): """('x' || substr(md5(COALESCE(array_to_string("watchedAnime", ','), '') || '|' || COALESCE(array_to_string("watchingAnime", ','), '')), 1, 16))::bit(64)::bigint""",
+}
+
+#Extra columns a snapshot keeps so it can later be refreshed with only the rows changed since it was written
+DELTA_COLUMNS = {
+
+    'ratings': ['ratingId', 'updated_at'],
+    'users': ['watchHash'],
+}
+
+def read_table(table, columns, where=None, params=None):
+
+    select_list = ', '.join(
+
+        f'{COLUMN_EXPRESSIONS[(table, column)]} AS "{column}"' if (table, column) in COLUMN_EXPRESSIONS else f'"{column}"'
+        for column in columns
+    )
+    where_clause = f" WHERE {where}" if where else ""
+    dtypes = {column: COLUMN_DTYPES[column] for column in columns if column in COLUMN_DTYPES}
+
+    table_df = pd.read_sql(text(f"SELECT {select_list} FROM {table}{where_clause}"), con=get_sync_engine(), params=params, dtype=dtypes)
+
+    for column in ID_LIST_COLUMNS:
+        if column in table_df.columns:
+            table_df[column] = table_df[column].apply(as_id_list)
+
+    return table_df
+
+def load_training_data(recommenders=ALL_RECOMMENDERS, source=None, with_delta_columns=False) -> dict:
+
+    if (source or TRAINING_DATA_SOURCE) == 'snapshot':
+
+        from .snapshot import open_snapshot
+        return open_snapshot(recommenders)
+
+    training_data = {}
 
-def load_data():
-    
     try:
-    
-        Ratings = pd.read_sql("SELECT * from ratings", con=sync_engine)
-        Anime = pd.read_sql("SELECT * from anime", con=sync_engine)
-        Users = pd.read_sql("SELECT * from users", con=sync_engine)
-        Locations = pd.read_sql("SELECT * from locations", con=sync_engine)
-        Genres = pd.read_sql("SELECT * from genres", con=sync_engine)
-        Seasons = pd.read_sql("SELECT * from seasons", con=sync_engine)
-        
-        return Ratings, Anime, Users, Locations, Genres, Seasons
-    
+
+        for table, columns in projected_columns(recommenders).items():
+
+            if with_delta_columns:
+                columns = columns + DELTA_COLUMNS.get(table, [])
+
+            training_data[table] = read_table(table, columns)
+
     except Exception as e:
-        
+
         raise ValueError(f"{e}")
-        return None, None, None, None, None, None
\ No newline at end of file
+
+    return training_data
+
+""" Delta queries: only rows changed since the last refresh are transferred """
+
+def load_ratings_since(watermark, columns):
+
+    #>= so rows written in the same instant as the watermark are not lost, the merge replaces them by ratingId
+    return read_table('ratings', columns, where='COALESCE("updated_at", "created_at") >= :watermark', params={'watermark': watermark})
+
+def load_rating_ids():
+
+    #Ratings can be deleted in the Django admin, the ids still in the table tell a delta refresh which ones are gone
+    return read_table('ratings', ['ratingId'])
+
+def load_watch_list_hashes():
+    return read_table('users', ['userId', 'watchHash'])
+
+def load_users(user_ids, columns):
+
+    if len(user_ids) == 0:
+        return read_table('users', columns, where='false')
+
+    return read_table('users', columns, where='"userId" = ANY(:user_ids)', params={'user_ids': [int(user_id) for user_id in user_ids]})
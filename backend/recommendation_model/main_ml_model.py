@@ -1,31 +1,194 @@
 #The main recommendation model
-import os, pandas as pd, numpy as np
-import scipy
 
-#Import all ML training methods from other modules
-from .load_data import load_data
-from .process_data import process_data
-from .Recommendation1 import collaborative_recommender
-from .Reccomendation2 import association_recommender
-from .Recommendation3 import content_based_recommender
+#Only the artifact bookkeeping is imported eagerly. The ML training methods of the other modules (and with them pandas,
+#numpy and scipy) are imported by the functions that use them, so importing this module from the API stays cheap
+#python -m recommendation_model.bench_import checks that this holds (through recommendation_model.executor)
+import threading
+from .model_artifact import save_artifact, load_artifact, latest_model_version, append_model_event, read_model_events, journal_position
 
-""" Start of the main ML Model """
+""" Offline training: builds all models once and saves them as a versioned artifact """
 
-def main_recommendation_model(user_id: int):
+def build_recommendation_models(training_data: dict) -> dict:
 
-    ratings, anime, users, locations, genres, seasons = load_data()
-    
-    #If none of the dframes are empty then preprocess the data
-    if all([df is not None for df in [ratings, anime, users, locations, genres, seasons]]):
+    from .Recommendation1 import build_collaborative_model
+    from .Reccomendation2 import build_association_model
+    from .Recommendation3 import build_content_model
+    from .Recommendation4 import build_factor_model
+    from .Recommendation5 import build_regional_model
+    from .Recommendation6 import build_session_model
 
-        preprocessed_df, processed_anime_df, processed_users_df, processed_genres_df, processed_seasons_df = process_data(ratings, anime, users, locations, genres, seasons)
-    
-    #get the recommendation o/p
-    recom1 = collaborative_recommender(user_id, ratings, processed_anime_df, 5)
-    recom2 = association_recommender(user_id, processed_users_df, processed_anime_df, 5)
-    recom3 = content_based_recommender(user_id, ratings, processed_anime_df, 5)
+    return {
 
-    return [recom1, recom2, recom3]
+        'collaborative': build_collaborative_model(training_data['ratings']),
+        'association': build_association_model(training_data['users']),
+        'content_based': build_content_model(training_data['ratings'], training_data['anime']),
+        'matrix_factorization': build_factor_model(training_data['ratings']),
+        'regional_popularity': build_regional_model(training_data['ratings'], training_data['users'], training_data['locations']),
+        'session': build_session_model(training_data['users']),
+    }
 
+def train_recommendation_models() -> str:
 
+    from .load_data import load_training_data
 
+    #Changes published from here on are not in the training data, save_artifact copies them into the new artifact's journal
+    journal_since = journal_position()
+
+    #Only the projected columns the recommenders read
+    training_data = load_training_data()
+
+    return save_artifact(build_recommendation_models(training_data), journal_since=journal_since)
+
+""" Serving: only loads the latest artifact and scores one user """
+
+#Models of the artifact currently held in memory by this process, and how far its event journal has been replayed
+_served_artifact = {'model_version': None, 'models': None, 'journal_offset': 0}
+
+#Recommender pool workers turn this off: the pool trains once at startup, N workers must not each train on their own
+TRAIN_IF_MISSING = True
+
+#Without a pool (RECOMMENDER_WORKERS=0) the recommenders of a request call get_trained_models from several threads at once,
+#only one of them may train, load the artifact or replay the journal into the shared models
+_served_artifact_lock = threading.Lock()
+
+def apply_model_event(models: dict, event: dict):
+
+    if event['type'] == 'rating':
+
+        from .Recommendation1 import apply_rating_update
+        from .Recommendation4 import fold_in_rating
+        apply_rating_update(models['collaborative'], event['user_id'], event['anime_id'], event['score'])
+        fold_in_rating(models['matrix_factorization'], event['user_id'], event['anime_id'], event['score'])
+
+    elif event['type'] == 'watch_lists':
+
+        #Association rules and co-watch neighbours stay as mined, only the lists they are applied to change
+        models['association']['user_watched_animes'][event['user_id']] = event['watched']
+        models['session']['user_watching_animes'][event['user_id']] = event['watching']
+
+    elif event['type'] == 'anime_genres':
+
+        from .Recommendation3 import update_anime_genres
+        update_anime_genres(models['content_based'], event['anime_id'], event['genres'])
+
+def get_trained_models() -> dict:
+
+    with _served_artifact_lock:
+
+        model_version = latest_model_version()
+
+        #Nothing trained yet, so the first request pays for one training run instead of every request (and the
+        #threads of the other recommenders wait for it on the lock)
+        if model_version is None:
+
+            if not TRAIN_IF_MISSING:
+                raise FileNotFoundError(f"No trained recommendation model found, run python -m recommendation_model.train_model")
+
+            print(f"No trained recommendation model found, training one now")
+            model_version = train_recommendation_models()
+
+        if _served_artifact['model_version'] != model_version:
+            payload = load_artifact(model_version)
+            _served_artifact['model_version'] = payload['model_version']
+            _served_artifact['models'] = payload['models']
+            _served_artifact['journal_offset'] = 0
+
+        #Changes written by any API process since the last call, usually none and then this is a single stat
+        events, _served_artifact['journal_offset'] = read_model_events(model_version, _served_artifact['journal_offset'])
+
+        for event in events:
+            apply_model_event(_served_artifact['models'], event)
+
+        return _served_artifact['models']
+
+#Order of the recommenders in every recommendation list returned to the API
+RECOMMENDER_NAMES = ('collaborative', 'association', 'content_based', 'matrix_factorization', 'session')
+
+def serve_recommender(recommender: str, user_id: int, number_of_recommendations: int = 5):
+
+    """ Scores one user with one of the recommenders, so the API can run them side by side, as (anime ids, scores) arrays """
+
+    models = get_trained_models()
+
+    if recommender == 'collaborative':
+
+        from .Recommendation1 import recommend_collaborative_scored
+        return recommend_collaborative_scored(models['collaborative'], user_id, number_of_recommendations)
+
+    if recommender == 'association':
+
+        from .Reccomendation2 import recommend_association_scored
+        return recommend_association_scored(models['association'], user_id, number_of_recommendations)
+
+    if recommender == 'content_based':
+
+        from .Recommendation3 import recommend_content_based_scored
+        return recommend_content_based_scored(models['content_based'], user_id, number_of_recommendations)
+
+    if recommender == 'matrix_factorization':
+
+        from .Recommendation4 import recommend_factors_scored
+        return recommend_factors_scored(models['matrix_factorization'], user_id, number_of_recommendations)
+
+    if recommender == 'session':
+
+        from .Recommendation6 import recommend_session_scored
+        return recommend_session_scored(models['session'], user_id, number_of_recommendations)
+
+    raise ValueError(f"Unknown recommender {recommender}")
+
+def serve_regional_popularity(user_id: int, location_id: int = None, number_of_recommendations: int = 5):
+
+    """ Popular anime in the user's region, what users without enough ratings for the other recommenders are shown """
+
+    from .Recommendation5 import recommend_regional
+
+    models = get_trained_models()
+
+    return recommend_regional(models['regional_popularity'], user_id, number_of_recommendations, location_id)
+
+def serve_next_anime(watching: list, excluded_ids: list, number_of_recommendations: int = 5):
+
+    """ Next anime for a watching list given by the caller, so a list that just changed is used before its event is replayed """
+
+    from .Recommendation6 import recommend_next
+
+    models = get_trained_models()
+
+    return recommend_next(models['session'], watching, number_of_recommendations, excluded_ids)
+
+def get_similar_anime(anime_id: int, number_of_results: int = 10):
+
+    from .Recommendation1 import similar_anime
+
+    models = get_trained_models()
+
+    return similar_anime(models['collaborative'], anime_id, number_of_results)
+
+def publish_model_event(event: dict):
+
+    #If nothing is trained yet the first training run reads the change from the database anyway
+    model_version = latest_model_version()
+
+    if model_version is None:
+        return
+
+    append_model_event(model_version, event)
+
+def update_served_rating(user_id: int, anime_id: int, score: int):
+
+    """ Keeps the served collaborative model fresh after a rating write, without retraining, in every process serving it """
+
+    publish_model_event({'type': 'rating', 'user_id': user_id, 'anime_id': anime_id, 'score': score})
+
+def update_served_watch_lists(user_id: int, watched: list, watching: list):
+
+    """ Call after a user's watched or watching list changed, so association and session recommendations use the new lists """
+
+    publish_model_event({'type': 'watch_lists', 'user_id': user_id, 'watched': list(watched), 'watching': list(watching)})
+
+def update_served_anime_genres(anime_id: int, genres: list):
+
+    """ Called by the Django admin when an anime is added, edited or deleted (db_admin_models.signals), the cached genre matrix is only rebuilt then """
+
+    publish_model_event({'type': 'anime_genres', 'anime_id': anime_id, 'genres': list(genres)})
@@ -0,0 +1,201 @@
+""" Versioned on-disk storage for the trained recommendation models
+
+Every training run writes its models into artifacts/<model_version>/ and then moves the LATEST
+pointer to that version, so serving processes never see a half written artifact
+"""
+
+import os, json, time
+
+#Bump this whenever the layout of the saved models dict changes so old artifacts are rejected
+ARTIFACT_FORMAT_VERSION = 10
+
+ARTIFACT_ROOT = os.getenv('RECOMMENDER_ARTIFACT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts'))
+LATEST_POINTER = 'LATEST'
+MODEL_FILE = 'model.joblib'
+MANIFEST_FILE = 'manifest.json'
+EVENT_JOURNAL_FILE = 'events.jsonl'
+
+#Arrays of these models are saved as plain float32 .npy files next to model.joblib and memory-mapped read only on load
+NPY_MODEL_ARRAYS = {'matrix_factorization': ('user_factors', 'item_factors')}
+
+
+def new_model_version() -> str:
+
+    #Millisecond resolution, a delta snapshot is often written within the same second as the one it is built from
+    now = time.time()
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime(now)) + f"{int(now * 1000) % 1000:03d}-{os.getpid()}"
+
+
+def artifact_dir(model_version: str) -> str:
+    return os.path.join(ARTIFACT_ROOT, model_version)
+
+
+def read_latest_pointer(root: str):
+
+    pointer_path = os.path.join(root, LATEST_POINTER)
+
+    if not os.path.exists(pointer_path):
+        return None
+
+    with open(pointer_path) as pointer:
+        version = pointer.read().strip()
+
+    return version or None
+
+
+def write_latest_pointer(root: str, version: str):
+
+    #Write the pointer to a temp file and rename it so readers only ever see a complete version id
+    pointer_path = os.path.join(root, LATEST_POINTER)
+    tmp_pointer_path = f"{pointer_path}.{os.getpid()}.tmp"
+
+    with open(tmp_pointer_path, 'w') as pointer:
+        pointer.write(version)
+    os.replace(tmp_pointer_path, pointer_path)
+
+
+def latest_model_version():
+    return read_latest_pointer(ARTIFACT_ROOT)
+
+
+def journal_position():
+
+    """Version and journal size of the artifact being served, None if there is none
+    Take it before loading the training data and pass it to save_artifact: changes published while the new models are
+    trained go to the old artifact's journal, and save_artifact carries them over into the new one
+    """
+
+    model_version = latest_model_version()
+
+    if model_version is None:
+        return None
+
+    journal_path = os.path.join(artifact_dir(model_version), EVENT_JOURNAL_FILE)
+
+    return model_version, os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+
+
+def carry_over_events(journal_since, model_version: str):
+
+    """ Appends the events of an older artifact's journal since journal_since to the journal of model_version, returns the new position """
+
+    old_version, offset = journal_since
+    events, offset = read_model_events(old_version, offset)
+
+    for event in events:
+        append_model_event(model_version, event)
+
+    return old_version, offset
+
+
+def save_artifact(models: dict, model_version: str = None, journal_since=None) -> str:
+
+    import joblib
+    import numpy as np
+
+    model_version = model_version or new_model_version()
+    target_dir = artifact_dir(model_version)
+    os.makedirs(target_dir, exist_ok=True)
+
+    models = dict(models)
+
+    for model_name, array_names in NPY_MODEL_ARRAYS.items():
+
+        if model_name not in models:
+            continue
+
+        models[model_name] = dict(models[model_name])
+
+        for array_name in array_names:
+            np.save(os.path.join(target_dir, f"{model_name}.{array_name}.npy"), np.asarray(models[model_name][array_name], dtype=np.float32))
+            models[model_name][array_name] = None
+
+    payload = {
+
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'model_version': model_version,
+        'models': models,
+    }
+    joblib.dump(payload, os.path.join(target_dir, MODEL_FILE))
+
+    manifest = {
+
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'model_version': model_version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'models': sorted(models.keys()),
+    }
+    with open(os.path.join(target_dir, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    #Events can overlap the training data, replaying them is harmless as every event carries the new state, not a difference
+    if journal_since is not None:
+        journal_since = carry_over_events(journal_since, model_version)
+
+    write_latest_pointer(ARTIFACT_ROOT, model_version)
+
+    #And the ones of writers that read the pointer just before it moved
+    if journal_since is not None:
+        carry_over_events(journal_since, model_version)
+
+    print(f"Saved recommendation model artifact {model_version} to {target_dir}")
+    return model_version
+
+
+def load_artifact(model_version: str = None) -> dict:
+
+    #joblib pulls in numpy, so it is only imported once an artifact is actually read or written
+    import joblib
+    import numpy as np
+
+    model_version = model_version or latest_model_version()
+
+    if model_version is None:
+        raise FileNotFoundError(f"No trained recommendation model found in {ARTIFACT_ROOT}")
+
+    #Arrays are memory-mapped copy-on-write: workers share the artifact's pages until a process changes one (incremental updates)
+    payload = joblib.load(os.path.join(artifact_dir(model_version), MODEL_FILE), mmap_mode='c')
+
+    if payload.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Model artifact {model_version} has format {payload.get('format_version')}, expected {ARTIFACT_FORMAT_VERSION}. Please retrain")
+
+    for model_name, array_names in NPY_MODEL_ARRAYS.items():
+
+        if model_name not in payload['models']:
+            continue
+
+        for array_name in array_names:
+            payload['models'][model_name][array_name] = np.load(os.path.join(artifact_dir(model_version), f"{model_name}.{array_name}.npy"), mmap_mode='r')
+
+    return payload
+
+
+def append_model_event(model_version: str, event: dict):
+
+    """Appends a change (a rating write, an anime's new genres) to the journal of an artifact
+    Every process serving that artifact replays the journal, so all of them see the change, not only the one that received it
+    """
+
+    line = json.dumps(event) + '\n'
+
+    #One small O_APPEND write per event, so concurrent writers never interleave inside a line
+    with open(os.path.join(artifact_dir(model_version), EVENT_JOURNAL_FILE), 'a') as journal:
+        journal.write(line)
+
+
+def read_model_events(model_version: str, offset: int = 0):
+
+    """ Events appended to the journal since offset and the offset to continue from, a partly written last line is left for the next read """
+
+    journal_path = os.path.join(artifact_dir(model_version), EVENT_JOURNAL_FILE)
+
+    if not os.path.exists(journal_path) or os.path.getsize(journal_path) <= offset:
+        return [], offset
+
+    with open(journal_path, 'rb') as journal:
+        journal.seek(offset)
+        pending = journal.read()
+
+    complete = pending[:pending.rfind(b'\n') + 1]
+
+    return [json.loads(line) for line in complete.splitlines()], offset + len(complete)
@@ -0,0 +1,96 @@
+""" Hybrid ranking stage that merges the (anime ids, scores) of every recommender into one ordered list
+
+Every recommender scores on its own scale (summed similarities, rule confidence, cosine, predicted score), so the
+scores of each list are first min-max normalised to [0, 1], then weighted and summed per anime. Watched and watching
+anime are removed and the rest is ordered by blended score, ties by anime id, so the same inputs always give the same list
+
+Weights come from RECOMMENDER_WEIGHTS, e.g. "collaborative=1,association=0.5,content_based=1,matrix_factorization=2",
+recommenders left out weigh 1 and a weight of 0 turns a recommender off
+"""
+
+import os
+import numpy as np
+
+def parse_weights(weights_text: str) -> dict:
+
+    weights = {}
+
+    for item in weights_text.split(','):
+
+        if '=' not in item:
+            continue
+
+        recommender, weight = item.split('=', 1)
+        weights[recommender.strip()] = float(weight)
+
+    return weights
+
+RECOMMENDER_WEIGHTS = parse_weights(os.getenv('RECOMMENDER_WEIGHTS', ''))
+
+def normalize_scores(scores):
+
+    """ Min-max scaling to [0, 1], a list whose scores are all equal gets 1 everywhere """
+
+    scores = np.asarray(scores, dtype=np.float64)
+
+    if len(scores) == 0:
+        return scores
+
+    low, high = scores.min(), scores.max()
+
+    if high - low <= 0:
+        return np.ones_like(scores)
+
+    return (scores - low) / (high - low)
+
+def rank_recommendations(scored_lists: dict, number_of_recommendations: int, excluded_ids=(), weights: dict = None):
+
+    """Blends {recommender: (anime ids, scores)} into the best number_of_recommendations (anime ids, blended scores), best first
+    excluded_ids (the user's watched and watching anime) never appear in the result
+    """
+
+    weights = RECOMMENDER_WEIGHTS if weights is None else weights
+
+    ids, blended = [], []
+
+    for recommender, (anime_ids, scores) in scored_lists.items():
+
+        weight = weights.get(recommender, 1.0)
+
+        if weight == 0 or len(anime_ids) == 0:
+            continue
+
+        ids.append(np.asarray(anime_ids, dtype=np.int64))
+        blended.append(weight * normalize_scores(scores))
+
+    if len(ids) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+    #One entry per anime holding the sum of its weighted scores over every list it appears in
+    unique_ids, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate(blended), minlength=len(unique_ids))
+
+    keep = ~np.isin(unique_ids, np.asarray(list(excluded_ids), dtype=np.int64))
+    unique_ids, totals = unique_ids[keep], totals[keep]
+
+    order = np.lexsort((unique_ids, -totals))[:number_of_recommendations]
+
+    return unique_ids[order], totals[order]
+
+def complete_recommendations(ranked_ids, ranked_scores, fallback_ids, number_of_recommendations: int, excluded_ids=()):
+
+    """Appends fallback_ids (in their order, with a blended score of 0) to a ranked list shorter than number_of_recommendations
+    Anime already ranked or excluded are skipped, so a user the recommenders know nothing about still gets a full list
+    """
+
+    missing = number_of_recommendations - len(ranked_ids)
+
+    if missing <= 0 or len(fallback_ids) == 0:
+        return ranked_ids, ranked_scores
+
+    fallback_ids = np.asarray(fallback_ids, dtype=np.int64)
+    skipped = np.concatenate([np.asarray(ranked_ids, dtype=np.int64), np.asarray(list(excluded_ids), dtype=np.int64)])
+
+    extra_ids = fallback_ids[~np.isin(fallback_ids, skipped)][:missing]
+
+    return np.concatenate([ranked_ids, extra_ids]), np.concatenate([ranked_scores, np.zeros(len(extra_ids))])
@@ -0,0 +1,111 @@
+""" Per user cache of served recommendations
+
+Entries are keyed by (userId, model version) and evicted least recently used once RECOMMENDATION_CACHE_SIZE is
+reached, or when older than RECOMMENDATION_CACHE_TTL_SECONDS. A new model version drops every entry
+
+Writes that change a user's recommendations (ratings, watched / watching list edits) invalidate that user right away
+in the API process that handled them, and reach the caches of the other API processes through the served artifact's
+event journal, which every lookup replays first
+
+Recommendations take a while to compute, so a write can land in between. The caller takes a generation with
+recommendation_generation before computing and passes it to cache_recommendations, which drops the result if the
+user (or the whole cache) was invalidated since
+"""
+
+import os, time
+from collections import OrderedDict
+
+from .model_artifact import latest_model_version, read_model_events
+
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', 10000))
+RECOMMENDATION_CACHE_TTL_SECONDS = float(os.getenv('RECOMMENDATION_CACHE_TTL_SECONDS', 600))
+
+#(userId, model version) -> (expiry time, recommendations), least recently used first
+#generation counts full clears, user_generations the invalidations of every user since the model version was loaded
+_cache = {'entries': OrderedDict(), 'model_version': None, 'journal_offset': 0, 'generation': 0, 'user_generations': {}}
+
+def _sync_with_model(model_version: str):
+
+    if _cache['model_version'] != model_version:
+        _cache['entries'].clear()
+        _cache['user_generations'].clear()
+        _cache['model_version'] = model_version
+        _cache['journal_offset'] = 0
+
+    events, _cache['journal_offset'] = read_model_events(model_version, _cache['journal_offset'])
+
+    for event in events:
+
+        #Events about one user only invalidate that user, an anime's new genres can change anyone's recommendations
+        if 'user_id' in event:
+            invalidate_user_recommendations(event['user_id'])
+        else:
+            _cache['entries'].clear()
+            _cache['generation'] += 1
+
+def get_cached_recommendations(user_id: int):
+
+    """ Recommendations cached for the user and the current model version, None on a miss """
+
+    model_version = latest_model_version()
+
+    if model_version is None:
+        return None
+
+    _sync_with_model(model_version)
+
+    key = (user_id, model_version)
+    entry = _cache['entries'].get(key)
+
+    if entry is None:
+        return None
+
+    expires_at, recommendations = entry
+
+    if expires_at < time.monotonic():
+        del _cache['entries'][key]
+        return None
+
+    _cache['entries'].move_to_end(key)
+
+    return recommendations
+
+def _current_generation(user_id: int):
+    return (_cache['model_version'], _cache['generation'], _cache['user_generations'].get(user_id, 0))
+
+def recommendation_generation(user_id: int):
+
+    """ Taken before computing a user's recommendations, cache_recommendations only keeps them if it is still current """
+
+    model_version = latest_model_version()
+
+    if model_version is not None:
+        _sync_with_model(model_version)
+
+    return _current_generation(user_id)
+
+def cache_recommendations(user_id: int, recommendations, generation=None):
+
+    model_version = latest_model_version()
+
+    if model_version is None:
+        return
+
+    _sync_with_model(model_version)
+
+    #Computed before a write that invalidated them (in this process or, through the journal, in another one)
+    if generation is not None and generation != _current_generation(user_id):
+        return
+
+    entries = _cache['entries']
+    entries[(user_id, model_version)] = (time.monotonic() + RECOMMENDATION_CACHE_TTL_SECONDS, recommendations)
+    entries.move_to_end((user_id, model_version))
+
+    while len(entries) > RECOMMENDATION_CACHE_SIZE:
+        entries.popitem(last=False)
+
+def invalidate_user_recommendations(user_id: int):
+
+    #Entries of older model versions are dropped on a version change, so a user has at most this one
+    _cache['entries'].pop((user_id, _cache['model_version']), None)
+    _cache['user_generations'][user_id] = _cache['user_generations'].get(user_id, 0) + 1
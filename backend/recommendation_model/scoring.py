@@ -0,0 +1,48 @@
+""" Shared helpers to pick the best scored anime out of score vectors / score matrices """
+
+import numpy as np
+
+def top_n_positions(scores, number_of_recommendations):
+
+    """Positions of the highest scores of a 1d score vector, best first
+    Entries set to -inf (already rated / watched anime) are never returned
+    """
+
+    number_of_candidates = min(number_of_recommendations, int(np.isfinite(scores).sum()))
+
+    if number_of_candidates <= 0:
+        return np.array([], dtype=np.int64)
+
+    top_positions = np.argpartition(-scores, number_of_candidates - 1)[:number_of_candidates]
+
+    return top_positions[np.argsort(-scores[top_positions], kind='stable')]
+
+def top_n_positions_per_row(scores, number_of_recommendations):
+
+    """ Same as top_n_positions for every row of a (users x anime) score matrix, returns one position array per row """
+
+    number_of_candidates = min(number_of_recommendations, scores.shape[1])
+
+    if number_of_candidates <= 0:
+        return [np.array([], dtype=np.int64) for _ in range(scores.shape[0])]
+
+    top_positions = np.argpartition(-scores, number_of_candidates - 1, axis=1)[:, :number_of_candidates]
+    top_scores = np.take_along_axis(scores, top_positions, axis=1)
+
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top_positions = np.take_along_axis(top_positions, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    return [row_positions[np.isfinite(row_scores)] for row_positions, row_scores in zip(top_positions, top_scores)]
+
+def no_recommendations():
+
+    """ Empty (anime ids, scores) pair, what a recommender returns when it has nothing for a user """
+
+    return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+def scored_recommendations(anime_ids, top_positions, scores):
+
+    """ (anime ids, scores) of the picked positions, best first, as every recommender returns them """
+
+    return np.asarray(anime_ids[top_positions], dtype=np.int64), np.asarray(scores[top_positions], dtype=np.float64)
@@ -0,0 +1,141 @@
+""" Columnar on-disk snapshot of the training dataset
+
+Every column the recommenders read is dumped as a .npy file into snapshots/<version>/, integer array columns
+(watch lists, anime genres) as a values file plus an offsets file. Training opens the files memory-mapped, so it
+reads local disk with zero copies instead of Postgres and every process reading the snapshot shares the same pages
+
+Every snapshot also keeps the ratingId / updated_at of the ratings and a fingerprint of every user's watch lists,
+plus the newest updated_at as a watermark, so the next one can be built from only the rows changed since (see delta_load.py)
+
+Run from the backend directory with:  python -m recommendation_model.snapshot
+Add --delta to build the new snapshot from the latest one and the changes since its watermark
+"""
+
+import os, json, time, argparse
+import numpy as np
+import pandas as pd
+
+from .load_data import ALL_RECOMMENDERS, ID_LIST_COLUMNS, projected_columns, load_training_data
+from .model_artifact import new_model_version, read_latest_pointer, write_latest_pointer
+
+SNAPSHOT_ROOT = os.getenv('RECOMMENDER_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+MANIFEST_FILE = 'manifest.json'
+
+def snapshot_dir(snapshot_version: str) -> str:
+    return os.path.join(SNAPSHOT_ROOT, snapshot_version)
+
+def latest_snapshot_version():
+    return read_latest_pointer(SNAPSHOT_ROOT)
+
+def _column_file(table, column, part=None):
+    return f"{table}.{column}.{part}.npy" if part else f"{table}.{column}.npy"
+
+def write_snapshot(training_data: dict = None, snapshot_version: str = None) -> str:
+
+    """ Dumps the projected training tables (fresh from the database unless given) and moves LATEST to the new snapshot """
+
+    training_data = load_training_data(ALL_RECOMMENDERS, source='database', with_delta_columns=True) if training_data is None else training_data
+    snapshot_version = snapshot_version or new_model_version()
+
+    target_dir = snapshot_dir(snapshot_version)
+    os.makedirs(target_dir, exist_ok=True)
+
+    manifest = {'snapshot_version': snapshot_version, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'watermark': None, 'tables': {}}
+
+    #Newest rating change the snapshot contains, a delta refresh asks the database for everything from there on
+    if 'ratings' in training_data and 'updated_at' in training_data['ratings'] and len(training_data['ratings']) > 0:
+        manifest['watermark'] = pd.Timestamp(training_data['ratings']['updated_at'].max()).isoformat()
+
+    for table, table_df in training_data.items():
+
+        manifest['tables'][table] = {'rows': len(table_df), 'columns': {}}
+
+        for column in table_df.columns:
+
+            if column in ID_LIST_COLUMNS:
+
+                #Ragged int lists are stored CSR style: values of all rows back to back, row i is values[offsets[i]:offsets[i + 1]]
+                lengths = table_df[column].apply(len).to_numpy(dtype=np.int64)
+                offsets = np.concatenate([[0], np.cumsum(lengths)])
+                values = np.fromiter((item for items in table_df[column] for item in items), dtype=np.int32, count=int(offsets[-1]))
+
+                np.save(os.path.join(target_dir, _column_file(table, column, 'offsets')), offsets)
+                np.save(os.path.join(target_dir, _column_file(table, column, 'values')), values)
+                manifest['tables'][table]['columns'][column] = 'int_list'
+
+            else:
+                values = table_df[column].to_numpy()
+
+                #Text columns (location names) as fixed width strings, python objects can't be memory-mapped
+                if values.dtype == object:
+                    values = table_df[column].fillna('').to_numpy(dtype=str)
+
+                np.save(os.path.join(target_dir, _column_file(table, column)), values)
+                manifest['tables'][table]['columns'][column] = str(values.dtype)
+
+    with open(os.path.join(target_dir, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    write_latest_pointer(SNAPSHOT_ROOT, snapshot_version)
+
+    print(f"Saved training data snapshot {snapshot_version} to {target_dir}")
+    return snapshot_version
+
+def read_snapshot_manifest(snapshot_version: str) -> dict:
+
+    with open(os.path.join(snapshot_dir(snapshot_version), MANIFEST_FILE)) as manifest_file:
+        return json.load(manifest_file)
+
+def open_snapshot(recommenders=ALL_RECOMMENDERS, snapshot_version: str = None, all_columns: bool = False) -> dict:
+
+    """Opens the projected columns of a snapshot memory-mapped, in the same shape load_training_data returns
+    Int list columns become lists of views into the mapped values file, so no row is copied either
+    all_columns opens every stored column of every table instead, which is what a delta refresh starts from
+    """
+
+    snapshot_version = snapshot_version or latest_snapshot_version()
+
+    if snapshot_version is None:
+        raise FileNotFoundError(f"No training data snapshot found in {SNAPSHOT_ROOT}")
+
+    source_dir = snapshot_dir(snapshot_version)
+    manifest = read_snapshot_manifest(snapshot_version)
+
+    if all_columns:
+        tables = {table: list(table_manifest['columns']) for table, table_manifest in manifest['tables'].items()}
+    else:
+        tables = projected_columns(recommenders)
+
+    training_data = {}
+
+    for table, columns in tables.items():
+
+        table_columns = {}
+
+        for column in columns:
+
+            if manifest['tables'][table]['columns'][column] == 'int_list':
+                offsets = np.load(os.path.join(source_dir, _column_file(table, column, 'offsets')), mmap_mode='r')
+                values = np.load(os.path.join(source_dir, _column_file(table, column, 'values')), mmap_mode='r')
+                table_columns[column] = [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+            else:
+                table_columns[column] = np.load(os.path.join(source_dir, _column_file(table, column)), mmap_mode='r')
+
+        training_data[table] = pd.DataFrame(table_columns, copy=False)
+
+    return training_data
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Write a columnar snapshot of the training data")
+    parser.add_argument('--delta', action='store_true', help="Build it from the latest snapshot and the rows changed since its watermark")
+    arguments = parser.parse_args()
+
+    if arguments.delta:
+
+        from .delta_load import refresh_snapshot
+        refresh_snapshot()
+
+    else:
+        write_snapshot()
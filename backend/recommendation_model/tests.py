@@ -1,3 +1,86 @@
-from django.test import TestCase
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
 
-# Create your tests here.
+from . import Recommendation1
+from .Recommendation1 import build_collaborative_model, recommend_collaborative_scored, recommend_collaborative_block, apply_rating_update
+
+def ratings_frame(rows):
+    return pd.DataFrame(rows, columns=['userId', 'animeId', 'score'])
+
+class CollaborativeScoringTests(unittest.TestCase):
+
+    def test_user_whose_rated_anime_has_no_neighbour(self):
+
+        #User 3's only rating is on an anime nobody else rated, so none of its neighbour slots is used
+        model = build_collaborative_model(ratings_frame([(1, 10, 8), (1, 11, 7), (2, 10, 6), (2, 12, 9), (3, 99, 5)]))
+
+        anime_ids, scores = recommend_collaborative_scored(model, 3, 5)
+
+        self.assertEqual(len(anime_ids), 0)
+        self.assertEqual(scores.dtype, np.float64)
+
+        #The block path used by the batch run agrees
+        self.assertEqual(len(recommend_collaborative_block(model, [3], 5)[0][0]), 0)
+
+    def test_index_without_neighbours(self):
+
+        model = build_collaborative_model(ratings_frame([(1, 10, 8), (1, 11, 7), (2, 10, 6)]), number_of_neighbours=0)
+
+        anime_ids, _ = recommend_collaborative_scored(model, 1, 5)
+
+        self.assertEqual(len(anime_ids), 0)
+
+    def test_rated_anime_are_never_recommended(self):
+
+        model = build_collaborative_model(ratings_frame([(1, 10, 8), (1, 11, 7), (2, 10, 6), (2, 12, 9)]))
+
+        anime_ids, scores = recommend_collaborative_scored(model, 1, 5)
+
+        self.assertEqual(anime_ids.tolist(), [12])
+        self.assertTrue(np.all(np.isfinite(scores)))
+
+class CollaborativeUpdateTests(unittest.TestCase):
+
+    def assert_matches_rebuild(self, compact_at):
+
+        rng = np.random.default_rng(7)
+
+        scores = {}
+        for _ in range(1500):
+            scores[(int(rng.integers(200)), int(rng.integers(80)))] = int(rng.integers(1, 11))
+
+        model = build_collaborative_model(ratings_frame([(user_id, anime_id, score) for (user_id, anime_id), score in scores.items()]), number_of_neighbours=10)
+
+        #New ratings, changed scores and anime nobody rated at training time
+        with mock.patch.object(Recommendation1, 'DOT_ROWS_COMPACT_AT', compact_at):
+
+            for _ in range(300):
+
+                user_id, anime_id, score = int(rng.integers(200)), int(rng.integers(85)), int(rng.integers(1, 11))
+                scores[(user_id, anime_id)] = score
+                apply_rating_update(model, user_id, anime_id, score)
+
+        rebuilt = build_collaborative_model(ratings_frame([(user_id, anime_id, score) for (user_id, anime_id), score in scores.items()]), number_of_neighbours=10)
+
+        #Neighbour lists can order tied anime differently, their similarities cannot differ
+        for anime_id, position in rebuilt['anime_index'].items():
+
+            np.testing.assert_allclose(model['neighbour_scores'][model['anime_index'][anime_id]], rebuilt['neighbour_scores'][position], atol=1e-5)
+
+        for user_id in range(200):
+
+            _, updated_scores = recommend_collaborative_scored(model, user_id, 5)
+            _, rebuilt_scores = recommend_collaborative_scored(rebuilt, user_id, 5)
+
+            np.testing.assert_allclose(updated_scores, rebuilt_scores, atol=1e-4)
+
+    def test_updates_match_a_rebuild(self):
+        self.assert_matches_rebuild(compact_at=1024)
+
+    def test_updates_match_a_rebuild_with_compaction(self):
+        self.assert_matches_rebuild(compact_at=8)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,12 @@
+""" Offline training entry point for the recommendation models
+
+Run from the backend directory with:  python -m recommendation_model.train_model
+Set RECOMMENDER_DATA_SOURCE=snapshot to train from the latest memory-mapped snapshot instead of Postgres
+"""
+
+from .main_ml_model import train_recommendation_models
+
+if __name__ == '__main__':
+
+    model_version = train_recommendation_models()
+    print(f"Recommendation models trained, serving version is now {model_version}")